@@ -0,0 +1,129 @@
+'''Times maze generation, solver evaluation and evolution, reporting throughput and peak memory as JSON'''
+
+#Run as python Benchmark.py [--nodes ...] [--densities ...] [--complexities ...] [--output results.json]
+#Each result records its parameters, seconds per run, throughput and peak traced memory so that runs
+#from different versions can be compared.
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import tracemalloc
+from random import Random
+from time import perf_counter
+import numpy as np
+from GenerateMaze import *
+from GenerateSolver import *
+
+def load_evolution(): #Maze Solver Evolution.py cannot be imported by name because of the spaces
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Maze Solver Evolution.py')
+    spec = importlib.util.spec_from_file_location('maze_solver_evolution', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module #lets worker processes find functions defined in it
+    spec.loader.exec_module(module)
+    return module
+
+def measure(function, repeats):
+    #seconds per call over repeats calls, then the peak memory of one more call traced separately
+    #so that tracing does not slow down the timed calls
+    start = perf_counter()
+    for i in range(repeats):
+        result = function()
+    seconds = (perf_counter() - start) / repeats
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+def record(results, name, params, seconds, peak, **throughput):
+    results.append({'benchmark': name, 'params': params, 'seconds': seconds,
+                    'throughput': {unit: count / seconds if seconds else None for unit, count in throughput.items()},
+                    'peak_memory_bytes': peak})
+
+def bench_generators(results, nodes, density, mazes, repeats):
+    paths = int(density * nodes)
+    params = {'nodes': nodes, 'paths': paths, 'mazes': mazes}
+    seconds, peak, result = measure(lambda: generate_mazes(Random(0), generate_simple_maze, mazes, nodes, paths), repeats)
+    record(results, 'generate_simple_maze', params, seconds, peak, mazes_per_second=mazes)
+    seconds, peak, result = measure(lambda: generate_mazes(Random(0), generate_tree_plus, mazes, make_randomizer(3), nodes, paths), repeats)
+    record(results, 'generate_tree_plus', params, seconds, peak, mazes_per_second=mazes)
+
+    tree = generate_simple_maze(Random(0), nodes, nodes - 1) #a bare tree, which fill_paths then adds paths to
+    def fill():
+        maze = np.copy(tree)
+        fill_paths(Random(0), maze, nodes, nodes - 1, paths)
+        return maze
+    seconds, peak, result = measure(fill, repeats)
+    record(results, 'fill_paths', params, seconds, peak, paths_per_second=paths - nodes + 1)
+
+def bench_matrix_operate(results, nodes, repeats):
+    generator = np.random.default_rng(0)
+    matrix = generator.integers(0, 2, (nodes, nodes), dtype=np.int8)
+    operator = generator.integers(0, 4, (nodes, nodes), dtype=np.int8)
+    calls = 100
+    def operate_all():
+        for i in range(calls):
+            matrix_operate(matrix, operator)
+    seconds, peak, result = measure(operate_all, repeats)
+    record(results, 'matrix_operate', {'nodes': nodes, 'calls': calls}, seconds, peak,
+           calls_per_second=calls, cells_per_second=calls * nodes * nodes)
+
+def bench_evaluation(results, nodes, density, complexity, mazes, solvers, repeats):
+    paths = int(density * nodes)
+    maze_set = generate_mazes(Random(0), generate_simple_maze, mazes, nodes, paths)
+    candidates = [generate_smart_solver(Random(i), {'nodes': nodes, 'complexity': complexity}) for i in range(solvers)]
+    def evaluate():
+        stats = {}
+        evaluate_smart_solver(candidates, {'random': Random(0), 'mazes': maze_set, 'evaluation_stats': stats})
+        return stats
+    seconds, peak, stats = measure(evaluate, repeats)
+    record(results, 'evaluate_smart_solver', {'nodes': nodes, 'paths': paths, 'complexity': complexity, 'mazes': mazes, 'solvers': solvers},
+           seconds, peak, evaluations_per_second=solvers, solver_steps_per_second=stats.get('steps', 0))
+
+def bench_evolution(results, evolution, nodes, density, complexity, mazes, solvers, generations):
+    paths = int(density * nodes)
+    def evolve():
+        with contextlib.redirect_stdout(io.StringIO()): #stats_observer prints every generation
+            evolution.evolve_smart_solvers(mazes=mazes, nodes=nodes, paths=paths, solvers=solvers, sel_pressure=solvers,
+                                           generations=generations, complexity=complexity, mutations=nodes, seed=0)
+    seconds, peak, result = measure(evolve, 1)
+    record(results, 'evolve_smart_solvers', {'nodes': nodes, 'paths': paths, 'complexity': complexity, 'mazes': mazes,
+                                             'solvers': solvers, 'generations': generations},
+           seconds, peak, evaluations_per_second=solvers * (generations + 1))
+
+def run_benchmarks(nodes=(10, 25, 50), densities=(1.5, 3), complexities=(2, 3), mazes=5, solvers=10, generations=2, repeats=3):
+    #times every benchmark over the grid of node counts, path densities (paths per node) and solver complexities
+    evolution = load_evolution()
+    results = []
+    for n in nodes:
+        bench_matrix_operate(results, n, repeats)
+        for density in densities:
+            bench_generators(results, n, density, mazes, repeats)
+            for complexity in complexities:
+                bench_evaluation(results, n, density, complexity, mazes, solvers, repeats)
+                bench_evolution(results, evolution, n, density, complexity, mazes, solvers, generations)
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(), 'results': results}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 25, 50])
+    parser.add_argument('--densities', type=float, nargs='+', default=[1.5, 3])
+    parser.add_argument('--complexities', type=int, nargs='+', default=[2, 3])
+    parser.add_argument('--mazes', type=int, default=5)
+    parser.add_argument('--solvers', type=int, default=10)
+    parser.add_argument('--generations', type=int, default=2)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='file to write the JSON report to, printed if not given')
+    options = parser.parse_args()
+    report = run_benchmarks(options.nodes, options.densities, options.complexities, options.mazes,
+                            options.solvers, options.generations, options.repeats)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
@@ -0,0 +1,180 @@
+'''Saves the state of an evolution run every few generations so that it can be resumed after a crash'''
+
+#A checkpoint is a compressed .npz file holding the population genomes in order, their fitness, the state of
+#the random generator, the generation and evaluation counters, the mazes being solved and the run's parameters.
+#Everything is stored as plain arrays, so checkpoints are loaded without unpickling anything. Mazes read from a
+#corpus are left out, the run's parameters naming the corpus and the mazes chosen from it instead.
+#Checkpoints are written by a background thread so the run only waits for the population to be copied.
+#Each checkpoint is written to a temporary file first and then renamed over the last one, so a crash while
+#writing leaves the previous checkpoint intact.
+
+import json
+import os
+import queue
+import threading
+import numpy as np
+from GenerateMaze import SparseMaze
+from GenerateSolver import MemorySolver, PackedSolver
+
+def pack_population(population): #genome arrays of the population, in order, and what kind of solvers they are
+    candidates = [individual.candidate for individual in population]
+    if isinstance(candidates[0], PackedSolver):
+        return {'kind': 'smart', 'genomes': np.stack([candidate.packed for candidate in candidates]), 'solver_nodes': candidates[0].nodes}
+    if isinstance(candidates[0], MemorySolver):
+        return {'kind': 'memory', 'genomes': np.stack([candidate.genome for candidate in candidates])}
+    return {'kind': 'array', 'genomes': np.stack(candidates)}
+
+def pack_random(random): #state of a random.Random as named arrays, i.e. its version, Mersenne Twister state and gauss_next
+    version, internal, gauss = random.getstate()
+    return {'random_version': version,
+            'random_internal': np.array(internal, np.uint32),
+            'random_gauss': np.array([] if gauss is None else [gauss], np.float64)}
+
+def unpack_random(checkpoint): #the state packed by pack_random, in the form taken by Random.setstate
+    gauss = checkpoint['random_gauss']
+    return (int(checkpoint['random_version']), tuple(int(x) for x in checkpoint['random_internal']), float(gauss[0]) if gauss.size else None)
+
+def pack_mazes(mazes): #maze set, single dense maze or sparse maze as named arrays, nothing for None
+    if mazes is None:
+        return {}
+    if isinstance(mazes, SparseMaze):
+        return {'maze_indptr': mazes.indptr, 'maze_indices': mazes.indices, 'maze_data': mazes.data}
+    return {'mazes': mazes}
+
+def unpack_mazes(checkpoint):
+    if 'maze_indptr' in checkpoint:
+        return SparseMaze(checkpoint['maze_indptr'], checkpoint['maze_indices'], checkpoint['maze_data'])
+    return checkpoint.get('mazes')
+
+def snapshot(population, random, num_generations, num_evaluations, mazes, params=None):
+    #copies everything a checkpoint needs, so that it can be written while the run carries on
+    state = pack_population(population)
+    fitness = [individual.fitness for individual in population]
+    state.update(pack_mazes(mazes))
+    state.update(pack_random(random))
+    state.update({'fitness': np.array(fitness),
+                  'generation': num_generations,
+                  'evaluations': num_evaluations,
+                  'params': json.dumps(params or {})})
+    return state
+
+def write_checkpoint(path, state):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as output:
+        np.savez_compressed(output, **state)
+    os.replace(temporary, path)
+
+def load_checkpoint(path):
+    #the checkpoint as a dict, with the candidates rebuilt as solvers and the random state as Random.getstate gives it
+    #mazes is None if they were left out, i.e. read from a corpus named in params
+    with np.load(path) as checkpoint:
+        checkpoint = {key: checkpoint[key] for key in checkpoint.files}
+    kind = str(checkpoint['kind'])
+    mazes = unpack_mazes(checkpoint)
+    genomes = checkpoint['genomes']
+    if kind == 'smart':
+        candidates = [PackedSolver(np.array(genome), int(checkpoint['solver_nodes'])) for genome in genomes]
+    elif kind == 'memory':
+        candidates = [MemorySolver(mazes, genome) for genome in genomes]
+        for candidate in candidates:
+            candidate.gen_path()
+    else:
+        candidates = [np.array(genome) for genome in genomes]
+    return {'kind': kind,
+            'candidates': candidates,
+            'fitness': checkpoint['fitness'].tolist(),
+            'random_state': unpack_random(checkpoint),
+            'generation': int(checkpoint['generation']),
+            'evaluations': int(checkpoint['evaluations']),
+            'mazes': mazes,
+            'params': json.loads(str(checkpoint['params']))}
+
+class Checkpointer():
+    #inspyred observer which checkpoints the run to path every given number of generations
+    #the random generator and mazes are read from args, mazes_key naming the maze set ('mazes') or single maze ('maze'),
+    #or None to leave the mazes out when params say where they come from
+    #params are stored with the checkpoint for resuming, e.g. the arguments the run was started with
+    def __init__(self, path, every=10, mazes_key='mazes', params=None, skip=None):
+        self.path = path
+        self.every = every
+        self.mazes_key = mazes_key
+        self.params = params
+        self.skip = skip #generation not to checkpoint, i.e. the one a resumed run starts from
+        self.queue = queue.Queue(maxsize=1) #at most one checkpoint waits, so a slow disk holds up the run rather than using up memory
+        self.thread = None
+        self.error = None
+        self.__name__ = type(self).__name__
+
+    def __call__(self, population, num_generations, num_evaluations, args):
+        if self.error is not None:
+            raise self.error
+        if num_generations % self.every or num_generations == self.skip or not population:
+            return
+        mazes = args[self.mazes_key] if self.mazes_key is not None else None
+        state = snapshot(population, args['_ec']._random, num_generations, num_evaluations, mazes, self.params)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._write, daemon=True)
+            self.thread.start()
+        self.queue.put(state)
+
+    def _write(self):
+        while True:
+            state = self.queue.get()
+            try:
+                if state is not None:
+                    write_checkpoint(self.path, state)
+            except Exception as error:
+                self.error = error #raised in the run at the next generation
+            finally:
+                self.queue.task_done()
+            if state is None:
+                return
+
+    def close(self): #waits for the last checkpoint to be written
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+def resume_evaluator(evaluator, fitness):
+    #returns the checkpointed fitness for the restored population instead of evaluating it again
+    #so that resuming draws nothing from the random generator, then evaluates as usual
+    pending = [list(fitness)]
+    def evaluate(candidates, args):
+        if pending:
+            return pending.pop()
+        return evaluator(candidates, args)
+    evaluate.__name__ = getattr(evaluator, '__name__', 'evaluate')
+    return evaluate
+
+def resume_observer(num_generations, num_evaluations):
+    #restores the generation and evaluation counters of the computation when it is first observed
+    #it must come before any other observer, so that they and the terminator see the restored counters
+    restored = [(num_generations, num_evaluations)]
+    def observe(population, num_generations, num_evaluations, args):
+        if restored:
+            args['_ec'].num_generations, args['_ec'].num_evaluations = restored.pop()
+    return observe
+
+def checkpoint_params(path): #just the parameters stored with a checkpoint, without loading the rest of it
+    with np.load(path) as checkpoint:
+        return json.loads(str(checkpoint['params']))
+
+def checkpoint_run(computation, evaluator, path=None, every=10, mazes_key='mazes', params=None, state=None):
+    #sets up a computation to be checkpointed to path and/or resumed from a loaded checkpoint state
+    #returns the evaluator to pass to evolve and the Checkpointer, which must be closed once the run ends
+    #a resumed run must be given state['candidates'] as its seeds, and must not use the random generator before evolving
+    observers = computation.observer if isinstance(computation.observer, (list, tuple)) else [computation.observer]
+    observers = list(observers)
+    checkpointer = None
+    if path is not None:
+        checkpointer = Checkpointer(path, every, mazes_key, params, None if state is None else state['generation'])
+        observers.append(checkpointer)
+    if state is not None:
+        computation._random.setstate(state['random_state'])
+        evaluator = resume_evaluator(evaluator, state['fitness'])
+        observers.insert(0, resume_observer(state['generation'], state['evaluations']))
+    computation.observer = observers
+    return evaluator, checkpointer
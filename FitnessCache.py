@@ -0,0 +1,99 @@
+'''Memoizes the fitness of candidates whose genome has already been evaluated'''
+
+from collections import OrderedDict
+import hashlib
+import numpy as np
+from GenerateMaze import SparseMaze
+from GenerateSolver import MemorySolver, PackedSolver
+
+def digest(*arrays): #fast hash of the bytes and shapes of some arrays
+    hasher = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        hasher.update(str(array.shape).encode())
+        hasher.update(array.tobytes())
+    return hasher.digest()
+
+def genome_key(candidate): #identifies a candidate by its genome alone
+    if isinstance(candidate, PackedSolver):
+        return digest(candidate.packed, np.array(candidate.nodes))
+    if isinstance(candidate, MemorySolver):
+        return digest(candidate.genome)
+    return digest(candidate)
+
+def maze_key(maze): #identifies a maze or maze set by its contents
+    if isinstance(maze, SparseMaze):
+        return digest(maze.indptr, maze.indices, maze.data)
+    if isinstance(maze, list):
+        return digest(*[maze_key(m) for m in maze])
+    return digest(maze)
+
+class FitnessCache():
+    #bounded least recently used cache of fitness values, keyed by candidate genome and maze set
+    #policy 'reuse' returns the stored fitness of a repeated genome without evaluating it again
+    #policy 'average' evaluates it again and returns the mean of all of its evaluations, for stochastic evaluators
+    def __init__(self, maxsize=10000, policy='reuse'):
+        if policy not in ('reuse', 'average'):
+            raise ValueError("policy must be 'reuse' or 'average'")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.entries = OrderedDict() #key -> [total fitness, number of evaluations]
+        self.hits = 0
+        self.misses = 0
+        self.maze = None #maze set of the previous call and its key, so it is only hashed when it changes
+        self.maze_key = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def evaluator(self, evaluator): #wraps an evaluator so that it goes through this cache
+        def evaluate(candidates, args):
+            return self.evaluate(evaluator, candidates, args)
+        evaluate.__name__ = getattr(evaluator, '__name__', 'evaluate')
+        return evaluate
+
+    def evaluate(self, evaluator, candidates, args):
+        mazes = args.get('mazes')
+        mazes = args.get('maze') if mazes is None else mazes
+        if mazes is not self.maze:
+            self.maze = mazes
+            self.maze_key = None if mazes is None else maze_key(mazes)
+
+        keys = [(self.maze_key, genome_key(candidate)) for candidate in candidates]
+        fitness = [None] * len(candidates)
+        pending = OrderedDict() #key -> indices of candidates to evaluate, only the first of each is evaluated when reusing
+        for index, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is not None or key in pending:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if self.policy == 'reuse':
+                    fitness[index] = entry[0]
+                    continue
+            if self.policy == 'reuse':
+                pending.setdefault(key, []).append(index)
+            else:
+                pending[(key, index)] = [index]
+
+        evaluated = [indices[0] for indices in pending.values()]
+        results = evaluator([candidates[index] for index in evaluated], args) if evaluated else []
+        cutoff = args.get('cutoff') #an evaluation abandoned past the cutoff only gives a lower bound, which is not stored
+        for indices, fit in zip(pending.values(), results):
+            if cutoff is not None and fit > cutoff:
+                for index in indices:
+                    fitness[index] = fit
+                continue
+            key = keys[indices[0]]
+            entry = self.entries.setdefault(key, [0, 0])
+            entry[0] += fit
+            entry[1] += 1
+            self.entries.move_to_end(key)
+            for index in indices:
+                fitness[index] = fit if entry[1] == 1 else entry[0] / entry[1]
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return fitness
@@ -2,95 +2,270 @@
 
 #Maze Generator
 
+import inspect
 import numpy as np
 import random
 
+class SparseMaze():
+    #compact maze for large node counts, stored as compressed sparse rows
+    #the paths out of node i go to indices[indptr[i]:indptr[i+1]], with matching values in data
+	def __init__(self, indptr, indices, data=None):
+		self.indptr = indptr
+		self.indices = indices
+		self.data = np.ones(indices.shape, np.int8) if data is None else data
+		self.shape = (indptr.shape[0] - 1, indptr.shape[0] - 1)
+		
+	@classmethod
+	def from_dense(cls, maze):
+		rows, columns = np.nonzero(maze)
+		indptr = np.zeros(maze.shape[0] + 1, np.int64)
+		np.cumsum(np.count_nonzero(maze, 1), out=indptr[1:])
+		return cls(indptr, columns.astype(np.int32), maze[rows, columns])
+		
+	def to_dense(self): #converts back to an adjacency matrix
+		maze = np.zeros(self.shape, self.data.dtype)
+		maze[np.repeat(np.arange(self.shape[0]), np.diff(self.indptr)), self.indices] = self.data
+		return maze
+		
+	def neighbors(self, node): #nodes with a path from the given node
+		return self.indices[self.indptr[node]:self.indptr[node+1]]
+		
+	def copy(self): #copies the values only, the path structure is shared as it is never modified
+		return SparseMaze(self.indptr, self.indices, np.copy(self.data))
+		
+	@property
+	def nbytes(self):
+		return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+		
+def neighbors(maze, node): #nodes with a path from the given node, for dense or sparse mazes
+	if isinstance(maze, SparseMaze):
+		return maze.neighbors(node)
+	return np.flatnonzero(maze[node, :])
+
 def add_path(node1, node2, maze, p): #adds a path between two nodes
 	maze[node1, node2] = 1
 	maze[node2, node1] = 1
 	return p + 1
 
-def check_full(maze, node, nodes): #checks if more paths can be added for a given node
-	return np.count_nonzero(maze, 1)[node] == nodes-1	
+class RandomSet():
+    #set of nodes with O(1) add, discard and uniform random choice, kept as a list plus each node's position in it
+	def __init__(self, nodes=()):
+		self.nodes = []
+		self.positions = {}
+		for node in nodes:
+			self.add(node)
+			
+	def __len__(self):
+		return len(self.nodes)
+		
+	def __contains__(self, node):
+		return node in self.positions
+		
+	def add(self, node):
+		if node not in self.positions:
+			self.positions[node] = len(self.nodes)
+			self.nodes.append(node)
+			
+	def discard(self, node): #moves the last node into the discarded node's place
+		position = self.positions.pop(node, None)
+		if position is None:
+			return
+		last = self.nodes.pop()
+		if position < len(self.nodes):
+			self.nodes[position] = last
+			self.positions[last] = position
+			
+	def choice(self, random):
+		return random.choice(self.nodes)
+		
+def free_neighbor(random, maze, node, degree, nodes, free):
+    #chooses a node not yet connected to the given node
+    #free holds the unconnected nodes of every node which is at least half connected, each built once when first needed
+	if 2 * degree < nodes: #at least half the nodes are free, so random picks are accepted in under 2 tries on average
+		while True:
+			j = random.randrange(nodes)
+			if j != node and not maze[node, j]:
+				return j
+	if node not in free: #building it costs O(nodes), paid for by the nodes/2 paths the node already has
+		free[node] = RandomSet(j for j in np.flatnonzero(maze[node, :]==0).tolist() if j != node)
+	return free[node].choice(random)
 	
 def fill_paths(random, maze, nodes, paths, maxpaths): 
     #adds additional paths up to specified maximum to the maze at random
-	empty = {node for node in range(nodes-1) if not check_full(maze, node, nodes)}
+    #degrees are tracked as paths are added so each added path costs O(1) on average
+	degree = np.count_nonzero(maze, 1)
+	empty = RandomSet(node for node in range(nodes-1) if degree[node] < nodes-1)
+	free = {} #free neighbors of the nodes which are at least half connected
 	
 	while paths < maxpaths:
-		i = random.choice(tuple(empty))
-		choices = np.where(maze[i,:]==0)[0].tolist()
-		choices.remove(i)
-		j = random.choice(choices)
+		i = empty.choice(random)
+		j = free_neighbor(random, maze, i, degree[i], nodes, free)
 		paths = add_path(i, j, maze, paths)
-		if check_full(maze, i, nodes):
+		if i in free:
+			free[i].discard(j)
+		if j in free:
+			free[j].discard(i)
+		degree[i] += 1
+		degree[j] += 1
+		if degree[i] == nodes-1:
 			empty.discard(i)
-		if check_full(maze, j, nodes):
+		if degree[j] == nodes-1:
 			empty.discard(j)		
 	
-def generate_simple_maze(random, nodes, paths):
+def generate_simple_maze(random, nodes, paths, sparse=False, out=None):
     #random maze which biases degree in favor of nodes closer to entry
-	maze = np.zeros((nodes, nodes), np.int8)
+    #out may be a preallocated zeroed node x node array to build the maze in
+	maze = np.zeros((nodes, nodes), np.int8) if out is None else out
 	i = 0
-	traversed = {0}
-	all_nodes = {node for node in range(nodes-1)}
+	order = list(range(1, nodes-1))
+	random.shuffle(order) #untraversed nodes in the order they are reached, same as picking one at random each time
+	traversed = [0]
 	p = 0
 	
-	while all_nodes - traversed:
-		j = random.choice(tuple(all_nodes-traversed))
+	for j in order:
 		p = add_path(i, j, maze, p)
-		traversed.add(j)
-		i = random.choice(tuple(traversed))
+		traversed.append(j)
+		i = random.choice(traversed)
 		
 	p = add_path(i, nodes-1, maze, p)
 	
 	fill_paths(random, maze, nodes, p, paths)
 			
-	return maze
+	return SparseMaze.from_dense(maze) if sparse else maze
 	
-def generate_tree_plus(random, degree_function, nodes, paths):
+def generate_tree_plus(random, degree_function, nodes, paths, sparse=False, out=None):
     #builds a tree like maze with specified degree for each node, plus additional random paths if desired
-	tree = np.zeros((nodes, nodes), np.int8)
+    #out may be a preallocated zeroed node x node array to build the maze in
+	tree = np.zeros((nodes, nodes), np.int8) if out is None else out
 	paths = paths if paths else nodes-1
 	i = 0
-	built = {0}
-	current_level = {0}
-	all_nodes = {node for node in range(nodes-1)}
+	order = list(range(1, nodes-1))
+	random.shuffle(order) #unbuilt nodes in the order they are added, same as picking one at random each time
+	built = 1 #nodes before the end node which are already in the tree
+	current_level = [0]
+	new_level = current_level
 	p = 0
 	link = 0
 	
-	while all_nodes - built:
-		new_level = set()
+	while built < nodes-1:
+		new_level = []
 		for i in current_level:
 			for degree in range(degree_function(random)):
-				if all_nodes - built:
-					j = random.choice(tuple(all_nodes - built))
+				if built < nodes-1:
+					j = order[built-1]
 					p = add_path(i, j, tree, p)
-					built.add(j)
-					new_level.add(j)
+					built += 1
+					new_level.append(j)
 				else:
 					link = i
 					break
-		current_level = new_level
+		current_level = sorted(new_level) #each level is worked through in node order
 	
-	link = link if link else random.choice(tuple(new_level))
+	link = link if link else random.choice(new_level)
 	p = add_path(link, nodes-1, tree, p)	
 		
 	fill_paths(random, tree, nodes, p, paths)
 	
-	return tree	
+	return SparseMaze.from_dense(tree) if sparse else tree	
 
-def generate_helix_maze(random, nodes=6, forks=2, junctions=1, min_segment=0, max_segment=1): 
+def check_helix(nodes, forks, junctions, min_segment, max_segment): #raises ValueError if no helix maze can be built
+	if forks < 1 or junctions < 0 or min_segment < 0 or max_segment < min_segment:
+		raise ValueError('helix maze needs forks >= 1, junctions >= 0 and 0 <= min_segment <= max_segment')
+	if nodes <= (junctions+1)*((forks-1)*max_segment + min_segment)+junctions+2:
+		raise ValueError('helix maze needs nodes > (junctions+1)((forks-1)*max_segment + min_segment)+junctions+2')
+	
+def generate_helix_maze(random, nodes=6, forks=2, junctions=1, min_segment=0, max_segment=1, sparse=False, out=None): 
     # nodes > (junctions+1)((forks-1)*max_segment + min_segment)+junctions+2
-	helix = np.zeros((nodes, nodes), np.int8)
-	junction_rows = [random.randint(1, nodes-2) for x in range(junctions)]
-	#complete this
-	
-def generate_mazes(random, maze_function, num_mazes=1, *args):
-	mazes = []
-	for i in range(num_mazes):
-		mazes.append(maze_function(random, *args))
-	return np.stack(mazes, axis=-1)
+    #the entry, the junctions and the exit are joined in a chain, with each pair joined by forks parallel segments
+    #forks-1 segments have between min_segment and max_segment nodes, the last takes the remaining nodes
+	check_helix(nodes, forks, junctions, min_segment, max_segment)
+	helix = np.zeros((nodes, nodes), np.int8) if out is None else out
+	order = list(range(1, nodes-1))
+	random.shuffle(order)
+	junction_rows = order[:junctions]
+	hubs = [0] + junction_rows + [nodes-1]
+	
+	lengths = [[random.randint(min_segment, max_segment) for x in range(forks-1)] + [min_segment] for y in range(junctions+1)]
+	for x in range(nodes - 2 - junctions - sum(map(sum, lengths))): #spreads the remaining nodes over the last segments
+		lengths[random.randrange(junctions+1)][-1] += 1
+		
+	p = 0
+	n = junctions
+	for section, segments in enumerate(lengths):
+		for length in segments:
+			i = hubs[section]
+			for j in order[n:n+length]:
+				p = add_path(i, j, helix, p)
+				i = j
+			p = add_path(i, hubs[section+1], helix, p)
+			n += length
+			
+	return SparseMaze.from_dense(helix) if sparse else helix
+	
+def path_lengths(maze):
+    #number of moves from the entry to every node, found by breadth first search, -1 for nodes which cannot be reached
+	nodes = maze.shape[0]
+	lengths = np.full(nodes, -1, np.int64)
+	lengths[0] = 0
+	frontier = [0]
+	length = 0
+	while frontier:
+		length += 1
+		adjacent = np.zeros(nodes, bool)
+		if isinstance(maze, SparseMaze):
+			for node in frontier:
+				adjacent[maze.neighbors(node)] = True
+		else:
+			adjacent = np.any(maze[frontier, :], 0)
+		frontier = np.flatnonzero(adjacent & (lengths < 0)).tolist()
+		lengths[frontier] = length
+	return lengths
+	
+def index_maze(maze):
+    #metadata of a single maze - shortest path length to the exit (-1 if unsolvable), degree of every node,
+    #and whether every node can be reached from the entry
+	lengths = path_lengths(maze)
+	degree = np.diff(maze.indptr) if isinstance(maze, SparseMaze) else np.count_nonzero(maze, 1)
+	return {'distance': int(lengths[-1]), 'degree': degree, 'connected': bool((lengths >= 0).all())}
+	
+def index_mazes(mazes):
+    #metadata of a maze set (a node x node x number_of_mazes array or a list of mazes), built once and kept with it
+	if isinstance(mazes, np.ndarray):
+		mazes = np.moveaxis(mazes, -1, 0)
+	indexes = [index_maze(maze) for maze in mazes]
+	distance = np.array([index['distance'] for index in indexes], np.int64)
+	return {'distance': distance,
+			'solvable': distance >= 0,
+			'degree': np.array([index['degree'] for index in indexes]),
+			'connected': np.array([index['connected'] for index in indexes], bool)}
+	
+def generate_mazes(random, maze_function, num_mazes=1, *args, **kwargs):
+    #sparse mazes are returned as a list, dense mazes are stacked into a node x node x num_mazes array
+    #dense mazes are built directly in one preallocated array when the maze function takes an out argument
+	first = maze_function(random, *args, **kwargs)
+	if isinstance(first, SparseMaze):
+		return [first] + [maze_function(random, *args, **kwargs) for i in range(1, num_mazes)]
+	mazes = np.zeros((num_mazes,) + first.shape, first.dtype) #each maze is contiguous in memory
+	mazes[0] = first
+	bulk = 'out' in inspect.signature(maze_function).parameters
+	for i in range(1, num_mazes):
+		if bulk:
+			maze_function(random, *args, out=mazes[i], **kwargs)
+		else:
+			mazes[i] = maze_function(random, *args, **kwargs)
+	return np.moveaxis(mazes, 0, -1)
+	
+def stream_mazes(random, maze_function, num_mazes=None, *args, **kwargs):
+    #yields mazes one at a time instead of building the whole set, without end if num_mazes is None
+	i = 0
+	while num_mazes is None or i < num_mazes:
+		yield maze_function(random, *args, **kwargs)
+		i += 1
+		
+def helix_mazes(random, num_mazes=None, nodes=6, forks=2, junctions=1, min_segment=0, max_segment=1, sparse=False):
+    #stream of helix mazes, with the parameters checked before any maze is requested
+	check_helix(nodes, forks, junctions, min_segment, max_segment)
+	return stream_mazes(random, generate_helix_maze, num_mazes, nodes, forks, junctions, min_segment, max_segment, sparse)
 	
 def make_constant(constant):
 	return lambda random: constant
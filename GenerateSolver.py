@@ -3,6 +3,7 @@
 
 import numpy as np
 import random
+from GenerateMaze import neighbors
 
 def print_multi_nparray(multi_array): #output display function
     layers = multi_array.shape[-1]
@@ -11,66 +12,133 @@ def print_multi_nparray(multi_array): #output display function
 
 class MemorySolver():
     #class of solvers that always try the same path - they can be evolved to better solve a given maze
-    def __init__(self, maze):
-        self.genome = np.copy(maze)
-        self.end = self.genome.shape[0] - 1
+    #the genome holds the node chosen next from each node, the maze is shared between solvers and never modified
+    def __init__(self, maze, genome=None):
+        self.maze = maze #dense or SparseMaze
+        self.end = maze.shape[0] - 1
+        self.genome = np.full(maze.shape[0], -1, np.int64) if genome is None else np.copy(genome)
         
-    def construct(self, random):
+    def __deepcopy__(self, memo): #copies of a solver keep sharing its maze
+        solver = MemorySolver(self.maze, self.genome)
+        if hasattr(self, 'path'):
+            solver.path = list(self.path)
+        return solver
+        
+    def construct(self, generator):
         #initializes this solver's path - i.e. its attempted solution
         i = 0
         j = 0
         end_reached = False
         self.path = []
+        traversed = set()
         
-        while j not in self.path:
+        while j not in traversed:
             self.path.append(j)
+            traversed.add(j)
             if j == self.end:
                 end_reached = True
-            j = random.choice(np.where(self.genome[i,:]==1)[0].tolist()) #choose a random path not previously chosen
-            self.genome[i, j] = 2 #marks this as a path taken in the genome
+            j = choose_neighbor(generator, self.maze, i) #choose a random path
+            self.genome[i] = j #marks this as the path taken in the genome
             i = j
             if end_reached:
                 break
                         
-        for i in [x for x in range(1, self.end+1) if x not in self.path]:
-            j = random.choice(np.where(self.genome[i,:]==1)[0].tolist())
-            self.genome[i, j] = 2
+        for i in [x for x in range(1, self.end+1) if x not in traversed]:
+            self.genome[i] = choose_neighbor(generator, self.maze, i)
             #paths are added so all nodes are traversed at least once by solution
             
     def gen_path(self):
         #traces the path indicated by the genome
         #this is for post evolutionary use in determining the new solution
-        i = 0
         j = 0
-        end_reached = False
         self.path = []
+        traversed = set()
         
-        while j not in self.path:
+        while j not in traversed:
             self.path.append(j)
+            traversed.add(j)
             if j == self.end:
-                end_reached = True
-            (j, ) = np.where(self.genome[i,:]==2)[0]
-            i = j
-            if end_reached:
-                break        
+                break
+            j = int(self.genome[j])
             
+def choose_neighbor(generator, maze, node): #choose one of the paths out of a node at random
+    options = neighbors(maze, node)
+    return int(options[generator.integers(options.shape[0])])
+
+def candidate_seeds(random, count):
+    #one seed per candidate drawn from the master generator, so each candidate's evaluation is reproducible on its own
+    return [random.getrandbits(64) for i in range(count)]
+
 def generate_memory_solver(random, args):
     solver = MemorySolver(args.get('maze'))
-    solver.construct(random)
+    solver.construct(np.random.default_rng(random.getrandbits(64)))
     return solver
     
 def evaluate_memory_solver(candidates, args):
+    #with normalize, steps are divided by the shortest path length of the maze from the maze_index in args
     fitness = []
+    index = args.get('maze_index')
+    optimal = int(index['distance'][0]) if index is not None and args.get('normalize') else 0
     
     for solver in candidates:
         try:
             fitness.append(solver.path.index(solver.end)) #num of steps taken to solve
         except ValueError: #if solver cannot solve the maze
             fitness.append(solver.end + 1)
+        if optimal > 0:
+            fitness[-1] /= optimal
         
     return fitness    
 
 #------------------------------------------------------------------------------    
+
+def pack_cells(cells): #packs values of 0 to 3 four to a byte along the last axis, whose length must be a multiple of 4
+    return cells[..., 0::4] | cells[..., 1::4] << 2 | cells[..., 2::4] << 4 | cells[..., 3::4] << 6
+
+def unpack_cells(packed, dtype=np.uint8): #the values packed by pack_cells, padding included
+    cells = np.empty(packed.shape[:-1] + (packed.shape[-1] * 4,), dtype)
+    for shift in range(4):
+        cells[..., shift::4] = (packed >> 2 * shift) & 3
+    return cells
+
+class PackedSolver():
+    #smart solver genome stored at 2 bits per cell, as its values are only ever 0 to 3
+    #each layer is packed into its own row of bytes, so whole layers can be exchanged without unpacking
+    def __init__(self, packed, nodes):
+        self.packed = packed #complexity x bytes array, 4 cells to a byte
+        self.nodes = nodes
+        self.shape = (nodes, nodes, packed.shape[0])
+
+    @classmethod
+    def pack(cls, solver):
+        nodes, complexity = solver.shape[0], solver.shape[2]
+        cells = np.zeros((complexity, -(-nodes * nodes // 4) * 4), np.uint8)
+        cells[:, :nodes * nodes] = np.moveaxis(solver, -1, 0).reshape(complexity, -1)
+        return cls(pack_cells(cells), nodes)
+
+    def unpack(self): #the solver as a node x node x complexity array
+        complexity = self.packed.shape[0]
+        cells = unpack_cells(self.packed, np.int8)
+        return np.ascontiguousarray(np.moveaxis(cells[:, :self.nodes * self.nodes].reshape(complexity, self.nodes, self.nodes), 0, -1))
+
+    def _locate(self, index): #byte and bit shift of a (row, column, layer) cell
+        row, column, layer = index
+        cell = row * self.nodes + column
+        return layer, cell // 4, 2 * (cell % 4)
+
+    def __getitem__(self, index):
+        layer, byte, shift = self._locate(index)
+        return (int(self.packed[layer, byte]) >> shift) & 3
+
+    def __setitem__(self, index, value):
+        layer, byte, shift = self._locate(index)
+        self.packed[layer, byte] = (int(self.packed[layer, byte]) & ~(3 << shift)) | (value << shift)
+
+    def copy(self):
+        return PackedSolver(np.copy(self.packed), self.nodes)
+
+def unpack_solver(solver): #smart solvers may be packed or plain arrays, evaluation needs the array
+    return solver.unpack() if isinstance(solver, PackedSolver) else solver
     
 def generate_smart_solver(random, args):
     #solvers that use a 3d matrix to generate a solution given a certain maze or set of mazes
@@ -84,7 +152,7 @@ def generate_smart_solver(random, args):
         for row in range(nodes):
             solver[row, :, layer] = [random.randint(0,3) for i in range(nodes)]
     #initializes random values between 0 and 3 for all layers except bottom layer
-    return solver
+    return PackedSolver.pack(solver)
 
 def identity_solver(nodes, complexity):
     #random but prefers not to revisit nodes - for performance comparison purposes
@@ -133,44 +201,110 @@ def operate(number, operator): #performs the operation specified by the solver m
     else: #a 3 operator returns the inverse of the number operated on
         return 1 - number
     
+#truth table of operate() - row is the operator, column is the number operated on
+OPERATIONS = np.array([[0, 0], #0 operator
+                       [1, 1], #1 operator
+                       [0, 1], #2 operator
+                       [1, 0]], np.int8) #3 operator
+
 def matrix_operate(matrix, operator): 
     #performs row and column wise operations between number matrix and operator matrix
-    result = np.zeros(matrix.shape, np.int8)
-    for i in range(matrix.shape[0]):
-        for j in range(matrix.shape[1]):
-            result[i, j] = operate(matrix[i, j], operator[i, j])
-    return result
-
-def choose(random, row): #choose at random between possible options, if multiples
-    if np.count_nonzero(row):
-        return random.choices([n for n in range(row.shape[0])], weights=row)
+    #equivalent to calling operate() on every element, done as a single lookup into the truth table
+    return OPERATIONS[operator, matrix]
+
+def choose(generator, row): #choose at random between possible options, if multiples, weighted by row
+    cumulative = np.cumsum(row)
+    if cumulative[-1]:
+        return (int(np.searchsorted(cumulative, generator.random() * cumulative[-1], side='right')), )
     else:
         return (-1, )
+
+class SolverWalk():
+    #state of a single smart solver walk through a maze, updated incrementally as nodes are visited
+    #visiting a node only changes one row and one column of the known matrix, so each visit costs O(nodes) per layer
+    def __init__(self, solver, maze):
+        self.solver = solver
+        self.maze = maze
+        nodes = maze.shape[0]
+        self.unvisited = np.ones(nodes, np.int64) #1s in place of each unvisited node, 0s for each visited node
+        self.known = np.zeros((nodes, nodes), np.int8) #maze adjacency as known by solver at current time
+        self.partials = {} #np.dot(unvisited, matrix_operate(known, layer)) for each layer used so far
+        self.current = 0 #current node initialized to beginning node of maze
+        self.steps = 0 #number of moves made so far
+        self.visit(0)
+
+    def options(self, layer):
+        #weights of the paths out of the current node as chosen by the given solver layer
+        if layer not in self.partials:
+            self.partials[layer] = np.dot(self.unvisited, matrix_operate(self.known, self.solver[:, :, layer]))
+        return np.multiply(self.partials[layer], self.maze[self.current, :]) #multiplication by maze adj matrix eliminates impossible choices
+
+    def visit(self, node): #mark a node as visited
+        if not self.unvisited[node]:
+            return
+        for layer, partial in self.partials.items(): #the node's row no longer counts once visited
+            partial -= OPERATIONS[self.solver[node, :, layer], self.known[node, :]]
+        self.unvisited[node] = 0
+        self.known[node, :] = self.maze[node, :]
+        self.known[:, node] = self.maze[:, node]
+        for layer, partial in self.partials.items(): #the node's column is now known to every row
+            partial[node] = np.dot(self.unvisited, OPERATIONS[self.solver[:, node, layer], self.known[:, node]])
+
+    def move(self, node):
+        self.current = node
+        self.steps += 1
+        self.visit(node)
         
 def evaluate_smart_solver(candidates, args): #mazes is a numpy array of node x node x number_of_mazes
-    random = args.get('random')
+    #each candidate's walks use their own generator, seeded from evaluation_seeds if given, otherwise from the random generator
+    #with a cutoff, a candidate is abandoned as soon as its fitness is certain to exceed it, using the minimum
+    #number of steps for each maze in lower_bounds (e.g. shortest path lengths) - its fitness is then that lower bound
+    #with a maze_index, unsolvable mazes are not walked as every walk on them runs to the step limit, and
+    #normalize divides the steps taken on solvable mazes by their total shortest path length, leaving unsolvable ones out
+    #solvers may have more nodes than the mazes, in which case only their first rows and columns are used
+    #evaluation_stats counts the steps and walks taken and the solver layers consulted, layers / steps being the mean fallback depth
+    seeds = args.get('evaluation_seeds') or candidate_seeds(args.get('random'), len(candidates))
     mazes = args.get('mazes')
+    cutoff = args.get('cutoff')
+    lower_bounds = args.get('lower_bounds')
+    lower_bounds = np.zeros(mazes.shape[2], np.int64) if lower_bounds is None else np.maximum(lower_bounds, 0)
+    stats = args.get('evaluation_stats') #counters are added to this dict if given
+    index = args.get('maze_index')
+    solvable = np.ones(mazes.shape[2], bool) if index is None else index['solvable']
+    scale = int(index['distance'][solvable].sum()) if index is not None and args.get('normalize') else 0
+    if scale:
+        lower_bounds = np.where(solvable, lower_bounds, 0)
+        cutoff = None if cutoff is None else cutoff * scale
 
     fitness = [] #will store the success value for solving attempt on each maze
     nodes = mazes.shape[0] #number of nodes in the maze
     
-    for solver in candidates:
+    for solver, seed in zip(candidates, seeds):
+        solver = unpack_solver(solver)[:nodes, :nodes] #solvers made for larger mazes are cut down to this maze set
+        generator = np.random.default_rng(seed)
         fit = 0
+        remaining = int(lower_bounds.sum()) #least number of steps still needed on the mazes not yet finished
+        abandoned = False
         for maze in range(mazes.shape[2]):
-            unvisited = [1 for x in range(nodes)] #list of 1s in place of each unvisited node, 0s for each visited node
-            tensor = np.zeros((nodes, nodes), np.int8)
-            current = 0 #current node initialized to beginning node of maze
-            steps = 0 #number of moves made so far
-            visit(0, unvisited, tensor)
+            remaining -= int(lower_bounds[maze])
+            if not solvable[maze]:
+                fit += 0 if scale else nodes**2
+                if stats is not None:
+                    stats['skipped_mazes'] = stats.get('skipped_mazes', 0) + 1
+                continue
+            walk = SolverWalk(solver, mazes[:, :, maze])
+            layers = 0 #number of solver layers consulted over the walk, more than one per step when falling back
             
-            while current != nodes - 1 and steps < nodes**2:
+            while walk.current != nodes - 1 and walk.steps < nodes**2:
+                if cutoff is not None and fit + max(walk.steps, int(lower_bounds[maze])) + remaining > cutoff:
+                    abandoned = True
+                    break
                 choice = -1
                 layer = -1
-                known = np.multiply(tensor, mazes[:, :, maze]) #yields the information of maze adjacency as known by solver at current time
             
                 while choice < 0:
                     try:
-                        M = matrix_operate(known, solver[:, :, layer]) #performs solver matrix operation to determine which path to take
+                        result = walk.options(layer) #performs solver matrix operation to determine which path to take
                     except IndexError:
                         print('Index Error')
                         break
@@ -178,15 +312,132 @@ def evaluate_smart_solver(candidates, args): #mazes is a numpy array of node x n
                         print('Type Error')
                         print(solver)
                         break
-                    result = np.multiply(np.dot(unvisited, M), mazes[current, :, maze]) #multiplication by maze adj matrix eliminates impossible choices
-                    (choice,) = choose(random, result)
+                    (choice,) = choose(generator, result)
                     layer -= 1
                     
-                current = choice
-                steps += 1
-                visit(choice, unvisited, tensor)
+                layers -= layer + 1
+                walk.move(choice)
                 
-            fit += steps
-        fitness.append(fit)
+            if stats is not None:
+                stats['steps'] = stats.get('steps', 0) + walk.steps
+                stats['walks'] = stats.get('walks', 0) + 1
+                stats['layers'] = stats.get('layers', 0) + layers
+            if abandoned:
+                bound = fit + max(walk.steps, int(lower_bounds[maze])) + remaining
+                if stats is not None:
+                    stats['abandoned'] = stats.get('abandoned', 0) + 1
+                    stats['saved_steps'] = stats.get('saved_steps', 0) + bound - fit - walk.steps #at least this many steps were not walked
+                fit = bound
+                break
+            fit += walk.steps
+        fitness.append(fit / scale if scale else fit)
         
     return fitness
+
+#------------------------------------------------------------------------------
+
+def draw_rows(generators, owners):
+    #one uniform draw per row from the generator of the candidate owning it, so no candidate's draws depend on another's
+    #owners must be sorted, as the walks of each candidate are kept together
+    draws = np.empty(owners.shape[0])
+    owner, start, count = np.unique(owners, return_index=True, return_counts=True)
+    for candidate, first, rows in zip(owner, start, count):
+        draws[first:first + rows] = generators[candidate].random(rows)
+    return draws
+
+def choose_rows(draws, rows): #choose at random in every row at once, -1 for rows with no options, as choose does for one
+    totals = rows.sum(1)
+    targets = draws * totals
+    choices = np.count_nonzero(np.cumsum(rows, 1) <= targets[:, None], 1)
+    choices[totals == 0] = -1
+    return choices
+
+def visit_rows(walks, nodes, unvisited, tensor): #mark a node as visited for each of the given walks
+    unvisited[walks, nodes] = 0
+    tensor[walks, nodes, :] = 1
+    tensor[walks, :, nodes] = 1
+
+def evaluate_smart_population(candidates, args):
+    #evaluates every candidate on every maze as one batch, advancing all (solver, maze) walks in lockstep
+    #drop-in replacement for evaluate_smart_solver, counting steps, walks and layers in evaluation_stats in the same way
+    #each candidate's walks draw from their own generator seeded as in evaluate_smart_solver, so a candidate's fitness
+    #does not depend on which other candidates are in the batch
+    #with a cutoff, a candidate is abandoned once the least number of steps its walks can take, counting a step more
+    #for each unfinished walk and no fewer than each maze's lower bound, exceeds it - its fitness is then that number
+    #maze_index and normalize skip unsolvable mazes and scale fitness as in evaluate_smart_solver
+    seeds = args.get('evaluation_seeds') or candidate_seeds(args.get('random'), len(candidates))
+    generators = [np.random.default_rng(seed) for seed in seeds]
+    stats = args.get('evaluation_stats')
+    mazes = np.moveaxis(args.get('mazes'), -1, 0) #number_of_mazes x node x node
+    cutoff = args.get('cutoff')
+    lower_bounds = args.get('lower_bounds')
+    lower_bounds = np.zeros(mazes.shape[0], np.int64) if lower_bounds is None else np.maximum(lower_bounds, 0)
+    index = args.get('maze_index')
+    solvable = np.ones(mazes.shape[0], bool) if index is None else index['solvable']
+    scale = int(index['distance'][solvable].sum()) if index is not None and args.get('normalize') else 0
+    cutoff = cutoff * scale if cutoff is not None and scale else cutoff
+    skipped = int(np.count_nonzero(~solvable)) #unsolvable mazes are not walked
+    extra = 0 if scale else skipped * mazes.shape[1]**2 #each counting as the step limit unless normalizing
+    mazes, lower_bounds = mazes[solvable], lower_bounds[solvable]
+
+    num_mazes, nodes = mazes.shape[0], mazes.shape[1]
+    population = np.stack([unpack_solver(solver)[:nodes, :nodes] for solver in candidates]) #candidates x node x node x complexity
+    complexity = population.shape[3]
+    walks = population.shape[0] * num_mazes
+    solver_index = np.repeat(np.arange(population.shape[0]), num_mazes) #solver used by each walk
+    maze_index = np.tile(np.arange(num_mazes), population.shape[0]) #maze walked by each walk
+
+    unvisited = np.ones((walks, nodes), np.int64) #1s in place of each unvisited node, per walk
+    tensor = np.zeros((walks, nodes, nodes), np.int8)
+    current = np.zeros(walks, np.intp) #current node of each walk
+    steps = np.zeros(walks, np.int64) #number of moves made so far by each walk
+    visit_rows(np.arange(walks), current, unvisited, tensor)
+    layers = 0 #number of solver layers consulted over all walks
+    solvers = population.shape[0]
+    abandoned = np.zeros(solvers, bool)
+    bounds = np.zeros(solvers, np.int64) #fitness of abandoned candidates, the least they could have taken
+
+    while True:
+        running = (current != nodes - 1) & (steps < nodes**2)
+        unfinished = running & ~abandoned[solver_index]
+        if cutoff is not None:
+            least = np.bincount(solver_index, np.maximum(steps + running, lower_bounds[maze_index]), solvers).astype(np.int64) + extra
+            over = np.flatnonzero((least > cutoff) & (np.bincount(solver_index[unfinished], minlength=solvers) > 0))
+            if over.size:
+                abandoned[over] = True
+                bounds[over] = least[over]
+                unfinished &= ~abandoned[solver_index]
+                if stats is not None:
+                    walked = np.bincount(solver_index, steps, solvers).astype(np.int64) + extra
+                    stats['abandoned'] = stats.get('abandoned', 0) + over.size
+                    stats['saved_steps'] = stats.get('saved_steps', 0) + int((least[over] - walked[over]).sum()) #at least this many steps were not walked
+        active = np.flatnonzero(unfinished)
+        if not active.size:
+            break
+        known = np.multiply(tensor[active], mazes[maze_index[active]])
+        choice = np.full(active.size, -1)
+        pending = np.arange(active.size) #walks in active which have not yet made a choice
+
+        for layer in range(complexity - 1, -1, -1): #falls back a layer for walks with no options
+            walk = active[pending]
+            layers += walk.size
+            M = OPERATIONS[population[solver_index[walk], :, :, layer], known[pending]]
+            result = np.matmul(unvisited[walk, None, :], M)[:, 0, :] * mazes[maze_index[walk], current[walk], :]
+            choice[pending] = choose_rows(draw_rows(generators, solver_index[walk]), result)
+            pending = pending[choice[pending] < 0]
+            if not pending.size:
+                break
+        #walks which ran out of layers move to -1, as in evaluate_smart_solver
+
+        current[active] = choice
+        steps[active] += 1
+        visit_rows(active, choice, unvisited, tensor)
+
+    if stats is not None:
+        stats['steps'] = stats.get('steps', 0) + int(steps.sum())
+        stats['walks'] = stats.get('walks', 0) + walks
+        stats['layers'] = stats.get('layers', 0) + layers
+        if skipped:
+            stats['skipped_mazes'] = stats.get('skipped_mazes', 0) + skipped * solvers
+    fitness = np.where(abandoned, bounds, steps.reshape(solvers, num_mazes).sum(1) + extra)
+    return (fitness / scale).tolist() if scale else fitness.tolist()
@@ -0,0 +1,103 @@
+'''Profiles how long each generation of an evolutionary computation spends in each of its stages'''
+
+#profiler = GenerationProfiler()
+#result, mazes = evolve_smart_solvers(..., profiler=profiler)
+#profiler.to_csv('profile.csv')
+#Each stage is timed with a pair of perf_counter calls, so leaving the profiler on costs next to nothing.
+
+import csv
+import json
+from time import perf_counter
+
+STAGES = ('selection', 'variation', 'evaluation', 'replacement')
+FIELDS = ('generation', 'seconds') + STAGES + ('other', 'evaluations', 'evaluations_per_second', 'steps', 'walks',
+                                               'mean_walk_length', 'mean_layer_depth')
+COUNTERS = ('steps', 'walks', 'layers') #evaluation_stats counters gathered for each generation
+
+class GenerationProfiler():
+    #records one row per generation: wall time, time spent in each stage and evaluator counters
+    #other is the time left over, i.e. generating the initial population, observers and inspyred itself
+    #mean_layer_depth is the mean number of smart solver layers consulted per step, 1 meaning no fallback was needed
+    def __init__(self):
+        self.records = []
+        self.start = None
+        self.evaluations = 0
+        self._reset()
+
+    def _reset(self):
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+    def timed(self, stage, function): #wraps an inspyred operator so its time is added to the given stage
+        def run(*args, **kwargs):
+            begin = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.times[stage] += perf_counter() - begin
+        run.__name__ = getattr(function, '__name__', stage)
+        return run
+
+    def evaluator(self, evaluator): #wraps an evaluator so its time and evaluation_stats counters are recorded
+        def evaluate(candidates, args):
+            stats = args.setdefault('evaluation_stats', {})
+            before = [stats.get(key, 0) for key in COUNTERS] #other observers may clear the stats between calls
+            begin = perf_counter()
+            try:
+                return evaluator(candidates, args)
+            finally:
+                self.times['evaluation'] += perf_counter() - begin
+                for key, value in zip(COUNTERS, before):
+                    self.counts[key] += stats.get(key, 0) - value
+        evaluate.__name__ = getattr(evaluator, '__name__', 'evaluate')
+        return evaluate
+
+    def instrument(self, computation):
+        #times the selector, variator and replacer of an inspyred computation and adds the observer to it
+        #the evaluator is passed to evolve rather than set on the computation, so it must be wrapped with evaluator
+        computation.selector = self.timed('selection', computation.selector)
+        if isinstance(computation.variator, (list, tuple)):
+            computation.variator = [self.timed('variation', variator) for variator in computation.variator]
+        else:
+            computation.variator = self.timed('variation', computation.variator)
+        computation.replacer = self.timed('replacement', computation.replacer)
+        observers = computation.observer if isinstance(computation.observer, (list, tuple)) else [computation.observer]
+        computation.observer = [self.observer] + list(observers)
+        self.start = perf_counter()
+        return computation
+
+    def observer(self, population, num_generations, num_evaluations, args): #closes the record of the generation just finished
+        now = perf_counter()
+        seconds = now - (self.start if self.start is not None else now)
+        evaluations = num_evaluations - self.evaluations
+        steps, walks, layers = (self.counts[key] for key in COUNTERS)
+        record = {'generation': num_generations, 'seconds': seconds}
+        record.update(self.times)
+        record.update({'other': seconds - sum(self.times.values()),
+                       'evaluations': evaluations,
+                       'evaluations_per_second': evaluations / self.times['evaluation'] if self.times['evaluation'] else None,
+                       'steps': steps,
+                       'walks': walks,
+                       'mean_walk_length': steps / walks if walks else None,
+                       'mean_layer_depth': layers / steps if steps else None})
+        self.records.append(record)
+        self.evaluations = num_evaluations
+        self._reset()
+        self.start = perf_counter()
+
+    def totals(self): #the records summed over every generation
+        seconds = sum(record['seconds'] for record in self.records)
+        totals = {stage: sum(record[stage] for record in self.records) for stage in STAGES + ('other', 'evaluations', 'steps', 'walks')}
+        totals['seconds'] = seconds
+        totals['evaluations_per_second'] = totals['evaluations'] / totals['evaluation'] if totals['evaluation'] else None
+        return totals
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as output:
+            writer = csv.DictWriter(output, FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def to_json(self, path):
+        with open(path, 'w') as output:
+            json.dump({'generations': self.records, 'totals': self.totals()}, output, indent=1)
@@ -6,39 +6,41 @@ from inspyred import ec
 from GenerateMaze import *
 from GenerateSolver import *
 from MicroEC import *
+from ParallelEvaluator import *
+from MazeCorpus import *
+from FitnessCache import *
+from Instrumentation import *
+from Checkpoint import *
+from MazeProvider import *
 
 def discard_useless(random, population, args): #removes obviously suboptimal solvers
 	return [x for x in population if x.fitness <= x.candidate.end]
 
 def cross_memory_solver(random, mom, dad, args): #crosses two solvers to produce offspring
-	child1 = MemorySolver(mom.genome)
-	child2 = MemorySolver(dad.genome)
+	child1 = MemorySolver(mom.maze, mom.genome)
+	child2 = MemorySolver(dad.maze, dad.genome)
 		
-	intersect = [x for x in mom.path if x in dad.path]
-	dad_only = [x for x in dad.path if x not in intersect]
-	mom_only = [x for x in mom.path if x not in intersect]
+	dad_path = set(dad.path)
+	intersect = [x for x in mom.path if x in dad_path] #kept in path order, so the shuffles below are repeatable
+	shared = set(intersect)
+	dad_only = [x for x in dad.path if x not in shared]
+	mom_only = [x for x in mom.path if x not in shared]
 	
-	for i in dad_only:
-		child1.genome[i, :] = dad.genome[i, :]
-	
-	for j in mom_only:
-		child2.genome[j, :] = mom.genome[j, :]
+	child1.genome[dad_only] = dad.genome[dad_only]
+	child2.genome[mom_only] = mom.genome[mom_only]
 
 	c = [mom, dad]
 	
 	for k in intersect:
 		random.shuffle(c)
-		child1.genome[k, :] = c[0].genome[k, :]
-		child2.genome[k, :] = c[1].genome[k, :]
+		child1.genome[k] = c[0].genome[k]
+		child2.genome[k] = c[1].genome[k]
 							
 	return (child1, child2)
 
 def mutate_memory_solver(random, candidate, args): #random mutation
 	row = random.randint(0, candidate.end)
-	(old_column, ) = np.where(candidate.genome[row, :]==2)[0]
-	candidate.genome[row, old_column] = 1
-	new_column = random.choice(np.where(candidate.genome[row,:]==1)[0].tolist())
-	candidate.genome[row, new_column] = 2
+	candidate.genome[row] = random.choice(neighbors(candidate.maze, row).tolist())
 	return candidate
 	
 def variate_memory_solver(random, candidates, args): #performs the generational variation process
@@ -48,6 +50,38 @@ def variate_memory_solver(random, candidates, args): #performs the generational
 		mutant.gen_path()
 	return mutants
 
+def variate_memory_population(random, candidates, args):
+    #drop-in replacement for variate_memory_solver which crosses and mutates all offspring at once on their stacked genomes
+    #children take the choices of nodes on one parent's path only from that parent, and of nodes on both from either at random
+	generator = np.random.default_rng(random.getrandbits(64))
+	candidates = candidates[:len(candidates) - len(candidates) % 2] #parents are paired as ec.variators.crossover does
+	if not candidates:
+		return []
+	maze = candidates[0].maze
+	genomes = np.stack([candidate.genome for candidate in candidates])
+	on_path = np.zeros(genomes.shape, bool)
+	for i, candidate in enumerate(candidates):
+		on_path[i, candidate.path] = True
+	moms, dads = genomes[0::2], genomes[1::2]
+	mom_path, dad_path = on_path[0::2], on_path[1::2]
+	swap = mom_path & dad_path & (generator.random(moms.shape) < 0.5) #shared nodes where the first child takes the dad's choice
+	children = np.empty_like(genomes)
+	children[0::2] = np.where((dad_path & ~mom_path) | swap, dads, moms)
+	children[1::2] = np.where((mom_path & ~dad_path) | swap, moms, dads)
+	
+	#one mutation per child, a random node taking a random path out of it from the maze's compressed rows
+	sparse = maze if isinstance(maze, SparseMaze) else SparseMaze.from_dense(maze)
+	rows = generator.integers(0, genomes.shape[1], children.shape[0])
+	degree = np.diff(sparse.indptr)[rows]
+	choice = sparse.indptr[rows] + (generator.random(children.shape[0]) * degree).astype(np.int64)
+	mutated = np.flatnonzero(degree) #nodes with no paths out are left alone
+	children[mutated, rows[mutated]] = sparse.indices[choice[mutated]]
+	
+	mutants = [MemorySolver(maze, child) for child in children]
+	for mutant in mutants:
+		mutant.gen_path()
+	return mutants
+
 def test_observer(population, num_generations, num_evaluations, args): #display function
 	print('Generation ' + str(num_generations))
 	for individual in population:
@@ -55,40 +89,69 @@ def test_observer(population, num_generations, num_evaluations, args): #display
 		print(individual.candidate.genome)
 		print(individual.fitness)
 
-def evolve_memory_solvers(nodes, paths, solvers, sel_pressure, generations, maze_function=generate_simple_maze): 
+def evolve_memory_solvers(nodes, paths, solvers, sel_pressure, generations, maze_function=generate_simple_maze, variator=variate_memory_solver, sparse=False, cache=None, seed=None, normalize=False, profiler=None, checkpoint=None, checkpoint_every=10, resume=None): 
     #performs evolutionary computuation for memory solvers		
+    #sparse stores the maze shared by all solvers as compressed rows, for large node counts
+    #variator can be variate_memory_population to vary the whole population at once
+    #evaluation only looks up where the end is on each solver's path, so it is always done in this process
+    #cache is a FitnessCache which skips evaluating genomes seen before, its hits and misses are kept on it
+    #seed makes the run repeatable
+    #normalize reports fitness relative to the maze's shortest path, 1 being optimal
+    #profiler is a GenerationProfiler which records how long each generation spends in each stage
+    #checkpoint is a file the run is saved to every checkpoint_every generations, resume a checkpoint file to continue from
 	rand = Random()
-	rand.seed(int(time()))
+	rand.seed(int(time()) if seed is None else seed)
 	computation = ec.EvolutionaryComputation(rand)
 	computation.terminator = ec.terminators.generation_termination
 	computation.selector = ec.selectors.rank_selection #could use rank or truncation or discard_useless
-	computation.variator = variate_memory_solver #could use default ec.variators.default_variation
+	computation.variator = variator #could use default ec.variators.default_variation
 	computation.replacer = ec.replacers.truncation_replacement #could use steady_state
 	computation.observer = ec.observers.stats_observer #could use test_observer
 	#migrator is default for now
 	#archiver is default for now
-	gen_maze = maze_function(rand, nodes, paths)
+	state = load_checkpoint(resume) if resume is not None else None
+	if state is not None:
+		gen_maze = state['mazes']
+	elif sparse:
+		gen_maze = maze_function(rand, nodes, paths, sparse=True)
+	else:
+		gen_maze = maze_function(rand, nodes, paths) #maze functions need not take sparse unless it is asked for
+	evaluator = evaluate_memory_solver
+	evaluator = cache.evaluator(evaluator) if cache is not None else evaluator
+	if profiler is not None:
+		profiler.instrument(computation)
+		evaluator = profiler.evaluator(evaluator)
+	params = {'nodes': nodes, 'paths': paths, 'solvers': solvers, 'sel_pressure': sel_pressure, 'generations': generations, 'sparse': sparse,
+		'seed': seed, 'normalize': normalize, 'checkpoint': checkpoint, 'checkpoint_every': checkpoint_every}
+	evaluator, checkpointer = checkpoint_run(computation, evaluator, checkpoint, checkpoint_every, 'maze', params, state)
 
-	return computation.evolve(generate_memory_solver, evaluate_memory_solver, pop_size=solvers, maximize=False, maze=gen_maze, num_selected=sel_pressure, max_generations=generations)
+	try:
+		return computation.evolve(generate_memory_solver, evaluator, pop_size=solvers, seeds=None if state is None else state['candidates'], maximize=False, random=rand, maze=gen_maze, maze_index=index_mazes([gen_maze]), normalize=normalize, num_selected=sel_pressure, max_generations=generations)
+	finally:
+		if checkpointer:
+			checkpointer.close()
+
+def resume_memory_solvers(path, **changes): #continues a memory solver run from its last checkpoint, see resume_smart_solvers
+	return evolve_memory_solvers(**dict(checkpoint_params(path), resume=path, **changes))
 
 #An example run:
 #result = evolve_memory_solvers(20, 15, 1000, 500, 20)
 #best_candidate = result[0].candidate
-#print_multi_nparray(best_candidate.genome)
+#print(best_candidate.path)
 #print(result[0].fitness)
 
 #########################################################
 
 def cross_smart_solver(random, mom, dad, args): #cross two parent solvers to produce offspring
-
-	child1 = np.copy(mom)
-	child2 = np.copy(dad)
+	#layers are exchanged as packed rows of bytes
+	child1 = mom.copy()
+	child2 = dad.copy()
 	parents = [mom, dad]
 	
 	for layer in range(1, mom.shape[2]):		
 		random.shuffle(parents)
-		child1[:, :, layer] = parents[0][:, :, layer]
-		child2[:, :, layer] = parents[1][:, :, layer]	
+		child1.packed[layer] = parents[0].packed[layer]
+		child2.packed[layer] = parents[1].packed[layer]	
 							
 	return (child1, child2)
 	
@@ -107,38 +170,202 @@ def variate_smart_solver(random, candidates, args): #performs generational varia
 	mutants = ec.variators.mutator(mutate_smart_solver)(random, children, args)
 	return mutants
 
-def evolve_smart_solvers(mazes, nodes, paths, solvers, sel_pressure, generations, complexity, mutations, maze_function=generate_simple_maze):		
+def variate_smart_population(random, candidates, args):
+    #drop-in replacement for variate_smart_solver which crosses and mutates all offspring at once on their stacked packed genomes
+    #pairs of parents exchange whole layers other than the first, then each child has mutations random cells set
+	generator = np.random.default_rng(random.getrandbits(64))
+	candidates = candidates[:len(candidates) - len(candidates) % 2] #parents are paired as ec.variators.crossover does
+	if not candidates:
+		return []
+	nodes = candidates[0].nodes
+	packed = np.stack([candidate.packed for candidate in candidates]) #candidates x complexity x bytes
+	moms, dads = packed[0::2], packed[1::2]
+	swap = generator.random(moms.shape[:2]) < 0.5 #layers the first child takes from the dad and the second from the mom
+	swap[:, 0] = False
+	children = np.empty_like(packed)
+	children[0::2] = np.where(swap[:, :, None], dads, moms)
+	children[1::2] = np.where(swap[:, :, None], moms, dads)
+	
+	mutations = args.get('mutations')
+	complexity = packed.shape[1]
+	if mutations and complexity > 1: #mutations are set on the unpacked cells of every child at once, then packed again
+		cells = unpack_cells(children)
+		count = children.shape[0] * mutations
+		child = np.repeat(np.arange(children.shape[0]), mutations)
+		cells[child, generator.integers(1, complexity, count), generator.integers(0, nodes * nodes, count)] = generator.integers(0, 4, count)
+		children = pack_cells(cells)
+	return [PackedSolver(child, nodes) for child in children]
+
+def provider_evaluator(evaluator, maze_provider, rescore=None):
+    #evaluates each generation on the next maze set and index from a MazeProvider
+    #the current population is scored again on the new set first with rescore (evaluator by default, which must not
+    #abandon anyone), so that replacement compares survivors and offspring on the same mazes - rescoring is not counted
+    #in num_evaluations
+	rescore = rescore or evaluator
+	def evaluate(candidates, args):
+		try:
+			args['mazes'], args['maze_index'] = next(maze_provider)
+		except StopIteration:
+			raise RuntimeError('the maze provider ran out of maze sets before the run ended') from None
+		population = args['_ec'].population
+		if population:
+			for individual, fitness in zip(population, rescore([x.candidate for x in population], dict(args, cutoff=None))):
+				individual.fitness = fitness
+		return evaluator(candidates, args)
+	evaluate.__name__ = getattr(evaluator, '__name__', 'evaluate')
+	return evaluate
+
+def provider_termination(maze_provider): #ends the run once a MazeProvider has no maze set left for another generation
+	def terminate(population, num_generations, num_evaluations, args):
+		return maze_provider.exhausted()
+	terminate.__name__ = 'provider_termination'
+	return terminate
+
+def bounded_evaluator(evaluator):
+    #abandons offspring that cannot survive truncation replacement - one worse than every current individual never does
+    #shortest path lengths give the least number of steps still needed on the mazes not yet walked
+	def evaluate(candidates, args):
+		index = args['maze_index']
+		population = args['_ec'].population
+		args['lower_bounds'] = np.where(index['solvable'], index['distance'], args['mazes'].shape[0]**2)
+		args['cutoff'] = max(x.fitness for x in population) if population else None
+		args.setdefault('evaluation_stats', {})
+		return evaluator(candidates, args)
+	evaluate.__name__ = getattr(evaluator, '__name__', 'evaluate')
+	return evaluate
+
+def savings_observer(population, num_generations, num_evaluations, args): #reports the work saved by early termination
+	stats = args.get('evaluation_stats', {})
+	print('Generation {}: {} candidates abandoned, {} steps walked, at least {} steps saved'.format(
+		num_generations, stats.get('abandoned', 0), stats.get('steps', 0), stats.get('saved_steps', 0)))
+	stats.clear()
+
+def evolve_smart_solvers(mazes, nodes, paths, solvers, sel_pressure, generations, complexity, mutations, maze_function=generate_simple_maze, evaluator=evaluate_smart_solver, variator=variate_smart_solver, workers=1, maze_stream=None, maze_provider=None, maze_set=None, maze_corpus=None, maze_indices=None, cache=None, seed=None, early_termination=False, normalize=False, profiler=None, checkpoint=None, checkpoint_every=10, resume=None, micro_evaluations=None, islands=1, migration_interval=5, migrants=1):		
     #performs evolutionary computation for smart solvers
+    #evaluator can be evaluate_smart_population to evaluate the whole population as one batch
+    #variator can be variate_smart_population to cross and mutate the whole population at once
+    #workers greater than 1 evaluates the population across that many processes, sharing the maze set between them
+    #maze_stream (e.g. helix_mazes) replaces the fixed maze set with a new set of mazes mazes drawn from it every generation,
+    #the run ending early if a finite stream runs out
+    #maze_provider is a MazeProvider giving each generation its own maze set, e.g. a rotating subsample of a corpus or
+    #generated sets growing from few to nodes nodes - solvers are made for nodes nodes and cut down to smaller mazes
+    #with a stream or provider, the population is scored again on each new set before replacement, so every fitness
+    #in it, and in the result, is on the same mazes as the last maze set returned
+    #maze_set trains on an existing node x node x number_of_mazes set instead of generating one, copied into every checkpoint
+    #maze_corpus trains on the mazes of a corpus file chosen by maze_indices (all of them by default), which checkpoints
+    #refer to by path and indices instead of holding the mazes
+    #cache is a FitnessCache which skips or averages repeated evaluations of the same genome on the same mazes
+    #seed makes the run repeatable, whatever the number of workers
+    #early_termination stops evaluating offspring which can no longer survive replacement, reporting the steps saved
+    #normalize reports fitness relative to the shortest paths of the solvable mazes, 1 being optimal
+    #profiler is a GenerationProfiler which records stage times, evaluations/sec, walk lengths and fallback layer depth per generation
+    #checkpoint is a file the run is saved to every checkpoint_every generations, resume a checkpoint file to continue from
+    #(see resume_smart_solvers) - the maze set and population are restored from it, but a maze stream or provider must be given again
+    #micro_evaluations evolves a series of micro-populations of that many evaluations each, seeded with the best so far (MicroEC)
+    #- it cannot checkpoint, as a micro-population's state is not kept between its generations
+    #islands greater than 1 evolves that many populations of solvers at once (IslandEC), across workers processes or one after
+    #another with a single worker, moving the best migrants of each to the next every migration_interval generations
+    #- it cannot stream, profile, checkpoint or cache, as the islands evaluate outside of the main computation
 	rand = Random()
-	rand.seed(int(time()))
-	computation = ec.EvolutionaryComputation(rand)
+	rand.seed(int(time()) if seed is None else seed)
+	if islands > 1:
+		if maze_stream is not None or maze_provider is not None or profiler is not None or checkpoint is not None or resume is not None or cache is not None:
+			raise ValueError('islands cannot be combined with maze_stream, maze_provider, profiler, checkpoint, resume or cache')
+		computation = IslandEC(rand, islands, migration_interval, migrants, workers)
+	elif micro_evaluations:
+		if checkpoint is not None or resume is not None: #observers only run between micro-populations, so checkpoints would be sporadic
+			raise ValueError('micro_evaluations cannot be combined with checkpoint or resume')
+		computation = MicroEC(rand)
+	else:
+		computation = ec.EvolutionaryComputation(rand)
 	computation.terminator = ec.terminators.generation_termination
 	computation.selector = ec.selectors.rank_selection #could use rank or truncation or discard_useless
-	computation.variator = variate_smart_solver #ec.variators.default_variation
+	computation.variator = variator #ec.variators.default_variation
 	computation.replacer = ec.replacers.truncation_replacement #could use steady_state
 	computation.observer = ec.observers.stats_observer #could use test_observer
+	if early_termination:
+		computation.observer = [ec.observers.stats_observer, savings_observer]
 	#migrator is default for now
 	#archiver is default for now
-	maze_set = generate_mazes(rand, maze_function, mazes, nodes, paths)
+	state = load_checkpoint(resume) if resume is not None else None
+	if maze_corpus is not None:
+		maze_indices = None if maze_indices is None else [int(k) for k in maze_indices] #a list, to be stored in the checkpoint params
+		maze_set = open_corpus(maze_corpus).mazes(maze_indices)
+	elif state is not None:
+		maze_set = state['mazes']
+	streamed = MazeProvider(stream_batches(maze_stream, mazes)) if maze_stream is not None else None
+	maze_provider = maze_provider or streamed
+	if maze_provider is not None: #a finite stream or provider ends the run early when it runs out
+		computation.terminator = [computation.terminator, provider_termination(maze_provider)]
+	if maze_set is None and maze_provider is None:
+		maze_set = generate_mazes(rand, maze_function, mazes, nodes, paths)
+	parallel = ParallelEvaluator(evaluator, workers) if workers > 1 and islands == 1 else None
+	evaluator = parallel or evaluator
+	evaluator = cache.evaluator(evaluator) if cache is not None else evaluator
+	rescore = evaluator #survivors are scored again in full on each new maze set, as the cutoff is taken from them
+	evaluator = bounded_evaluator(evaluator) if early_termination else evaluator
+	evaluator = provider_evaluator(evaluator, maze_provider, rescore) if maze_provider is not None else evaluator
+	if profiler is not None:
+		profiler.instrument(computation)
+		evaluator = profiler.evaluator(evaluator)
+	params = {'mazes': mazes, 'nodes': nodes, 'paths': paths, 'solvers': solvers, 'sel_pressure': sel_pressure, 'generations': generations, 'complexity': complexity,
+		'mutations': mutations, 'seed': seed, 'early_termination': early_termination, 'normalize': normalize, 'checkpoint': checkpoint, 'checkpoint_every': checkpoint_every,
+		'maze_corpus': maze_corpus, 'maze_indices': maze_indices}
+	evaluator, checkpointer = checkpoint_run(computation, evaluator, checkpoint, checkpoint_every, 'mazes' if maze_corpus is None else None, params, state)
+
+	try:
+		result = computation.evolve(generate_smart_solver, evaluator, pop_size=solvers, seeds=None if state is None else state['candidates'], maximize=False, num_selected=sel_pressure, max_generations=generations, nodes=nodes, complexity=complexity, random=rand, mazes=maze_set, maze_index=None if maze_set is None else index_mazes(maze_set), normalize=normalize, mutations=mutations, micro_evaluations=micro_evaluations)
+		return (result, computation._kwargs['mazes']) #the last maze set used when streaming
+	finally:
+		if parallel:
+			parallel.close()
+		if streamed:
+			streamed.close()
+		if checkpointer:
+			checkpointer.close()
 
-	return (computation.evolve(generate_smart_solver, evaluate_smart_solver, pop_size=solvers, maximize=False, num_selected=sel_pressure, max_generations=generations, nodes=nodes, complexity=complexity, random=rand, mazes=maze_set, mutations=mutations), maze_set)
+def resume_smart_solvers(path, **changes):
+    #continues a smart solver run from its last checkpoint, exactly as it would have gone on without stopping
+    #changes overrides the parameters it was started with, e.g. generations to run for longer, or evaluator and variator if they were not the defaults
+	return evolve_smart_solvers(**dict(checkpoint_params(path), resume=path, **changes))
 
 def evaluate_mazes(mazes, nodes):
     #evaluates mazes using preset solvers for performance comparison purposes
-    args = {'random': Random(), 'mazes': mazes}
+    #each result is given in steps and as a multiple of the shortest paths through the solvable mazes
+    index = index_mazes(mazes)
+    args = {'random': Random(), 'mazes': mazes, 'maze_index': index}
     identity = identity_solver(nodes, 2)
     dfs = dfs_solver(nodes, 2)
     optimal = optimal_solver(nodes)
-    print('Identity does it in ')
-    print(evaluate_smart_solver([identity], args))
-    print('DFS does it in ')
-    print(evaluate_smart_solver([dfs], args))
-    print('Optimal does it in')
-    print(evaluate_smart_solver([optimal], args))
+    shortest = int(index['distance'][index['solvable']].sum())
+    unsolvable = int(np.count_nonzero(~index['solvable']))
+    print('Shortest paths take ' + str(shortest) + ' steps, ' + str(unsolvable) + ' mazes are unsolvable')
+    for name, solver in (('Identity', identity), ('DFS', dfs), ('Optimal', optimal)):
+        print(name + ' does it in ')
+        steps = evaluate_smart_solver([solver], args) #each unsolvable maze counts nodes**2 steps, which normalizing leaves out
+        print(steps, [(steps[0] - unsolvable * nodes**2) / shortest] if shortest else steps)
 
 #An example run:
 #result, mazes = evolve_smart_solvers(mazes=5, nodes=10, paths=10, solvers=100, sel_pressure=50, generations=5, complexity=3, mutations=20)
 #evaluate_mazes(mazes, 10)
+#or sharing one maze corpus between runs:
+#write_corpus('mazes.corpus', generate_mazes(Random(), generate_simple_maze, 1000, 10, 10))
+#result, mazes = evolve_smart_solvers(mazes=None, nodes=10, paths=None, solvers=100, sel_pressure=50, generations=5, complexity=3, mutations=20, maze_corpus='mazes.corpus', maze_indices=range(5))
+#or recording where the time goes in each generation:
+#profiler = GenerationProfiler()
+#result, mazes = evolve_smart_solvers(mazes=5, nodes=10, paths=10, solvers=100, sel_pressure=50, generations=5, complexity=3, mutations=20, profiler=profiler)
+#profiler.to_csv('profile.csv')
+#or checkpointing a long run every 10 generations, and picking it up again after a crash:
+#result, mazes = evolve_smart_solvers(mazes=5, nodes=10, paths=10, solvers=100, sel_pressure=50, generations=500, complexity=3, mutations=20, checkpoint='run.npz')
+#result, mazes = resume_smart_solvers('run.npz')
+#or evolving 4 islands of 100 solvers in parallel, migrating the best 2 of each every 5 generations:
+#result, mazes = evolve_smart_solvers(mazes=5, nodes=10, paths=10, solvers=100, sel_pressure=50, generations=50, complexity=3, mutations=20, islands=4, migrants=2, workers=4)
+#or training on a new subsample of 5 mazes from a corpus every generation:
+#result, mazes = evolve_smart_solvers(mazes=5, nodes=10, paths=None, solvers=100, sel_pressure=50, generations=5, complexity=3, mutations=20, maze_provider=MazeProvider(subsample_batches(Random(), open_corpus('mazes.corpus'), 5)))
+#or on new mazes growing from 10 to 30 nodes over the run:
+#result, mazes = evolve_smart_solvers(mazes=5, nodes=30, paths=None, solvers=100, sel_pressure=50, generations=40, complexity=3, mutations=20, maze_provider=MazeProvider(generated_batches(Random(), generate_simple_maze, 5, growing_nodes(10, 30, 2))))
+#or training on a stream of helix mazes:
+#result, mazes = evolve_smart_solvers(mazes=5, nodes=20, paths=None, solvers=100, sel_pressure=50, generations=5, complexity=3, mutations=20, maze_stream=helix_mazes(Random(), None, 20, 2, 2, 1, 3))
 #best_candidate = result[0].candidate
-#print_multi_nparray(best_candidate)
+#print_multi_nparray(unpack_solver(best_candidate))
 #print(result[0].fitness)
\ No newline at end of file
@@ -0,0 +1,100 @@
+'''Stores maze sets on disk so that they can be shared between runs'''
+
+#A corpus file is a 32 byte header followed by one record per maze.
+#Mazes are symmetric with an empty diagonal, so each record is just the upper triangle of the
+#adjacency matrix packed 8 paths to a byte. Records are read straight from the file through np.memmap.
+#The maze metadata from index_maze is kept next to the corpus in an .index.npz file.
+
+import os
+import struct
+import numpy as np
+from GenerateMaze import SparseMaze, index_maze, index_mazes
+
+MAGIC = b'MAZECORP'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQ8x') #magic, version, nodes, number of mazes, padding
+
+def index_path(path):
+    return path + '.index.npz'
+
+def pack_maze(maze, upper): #packs the upper triangle of a dense or sparse maze into bits
+    maze = maze.to_dense() if isinstance(maze, SparseMaze) else maze
+    return np.packbits(maze[upper] != 0)
+
+def write_corpus(path, mazes):
+    #writes mazes to a new corpus file
+    #mazes may be a node x node x number_of_mazes array or any iterable of mazes, such as a maze stream
+    if isinstance(mazes, np.ndarray):
+        mazes = np.moveaxis(mazes, -1, 0) #iterates over the last axis
+    count = 0
+    nodes = 0
+    indexes = []
+    with open(path, 'wb') as corpus:
+        corpus.write(HEADER.pack(MAGIC, VERSION, 0, 0)) #rewritten once the number of mazes is known
+        for maze in mazes:
+            if not count:
+                nodes = maze.shape[0]
+                upper = np.triu_indices(nodes, 1)
+            elif maze.shape[0] != nodes:
+                raise ValueError('all mazes in a corpus must have the same number of nodes')
+            corpus.write(pack_maze(maze, upper).tobytes())
+            indexes.append(index_maze(maze))
+            count += 1
+        corpus.seek(0)
+        corpus.write(HEADER.pack(MAGIC, VERSION, nodes, count))
+    np.savez(index_path(path),
+             distance=np.array([index['distance'] for index in indexes], np.int64),
+             degree=np.array([index['degree'] for index in indexes], np.int64).reshape(count, nodes),
+             connected=np.array([index['connected'] for index in indexes], bool))
+    return count
+
+class MazeCorpus():
+    #read only view of a corpus file - mazes are unpacked on demand, nothing else is loaded into memory
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as corpus:
+            magic, version, self.nodes, self.num_mazes = HEADER.unpack(corpus.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a version {} maze corpus'.format(path, VERSION))
+        self.upper = np.triu_indices(self.nodes, 1)
+        self.paths = self.upper[0].shape[0] #number of possible paths, i.e. bits per maze
+        self.packed = np.memmap(path, np.uint8, 'r', offset=HEADER.size,
+                                shape=(self.num_mazes, (self.paths + 7) // 8)) if self.num_mazes else np.zeros((0, 0), np.uint8)
+
+    def __len__(self):
+        return self.num_mazes
+
+    def __getitem__(self, k): #a single maze as a node x node adjacency matrix
+        maze = np.zeros((self.nodes, self.nodes), np.int8)
+        bits = np.unpackbits(self.packed[k], count=self.paths)
+        maze[self.upper] = bits
+        maze[self.upper[1], self.upper[0]] = bits
+        return maze
+
+    def __iter__(self):
+        return (self[k] for k in range(self.num_mazes))
+
+    def index(self, indices=None):
+        #metadata of the chosen mazes in the form returned by index_mazes, all of them by default
+        #read from the index file written with the corpus, or built from the mazes if there is none
+        if not hasattr(self, 'metadata'):
+            if os.path.exists(index_path(self.path)):
+                with np.load(index_path(self.path)) as index:
+                    self.metadata = {key: index[key] for key in index.files}
+            else:
+                self.metadata = index_mazes(self.mazes())
+            self.metadata['solvable'] = self.metadata['distance'] >= 0
+        indices = np.arange(self.num_mazes) if indices is None else np.asarray(indices)
+        return {key: value[indices] for key, value in self.metadata.items()}
+
+    def mazes(self, indices=None):
+        #several mazes as a node x node x number_of_mazes array, like generate_mazes, all of them by default
+        indices = np.arange(self.num_mazes) if indices is None else np.asarray(indices)
+        mazes = np.zeros((indices.shape[0], self.nodes, self.nodes), np.int8)
+        bits = np.unpackbits(self.packed[indices], axis=1, count=self.paths)
+        mazes[:, self.upper[0], self.upper[1]] = bits
+        mazes[:, self.upper[1], self.upper[0]] = bits
+        return np.moveaxis(mazes, 0, -1)
+
+def open_corpus(path):
+    return MazeCorpus(path)
@@ -0,0 +1,130 @@
+'''Feeds each generation a new maze set, prepared in the background while the previous one is evaluated'''
+
+#A provider takes any iterator of maze sets - a rotating subsample of a fixed set or corpus, freshly generated
+#sets (whose node count can grow over time), or sets grouped from a maze stream - and indexes each one with
+#index_mazes in a producer thread, keeping a few sets ready so that the evaluator does not wait for them.
+#Batch sources use their own random generator, so the sets produced do not depend on thread timing.
+
+import queue
+import threading
+import numpy as np
+from GenerateMaze import generate_mazes, index_mazes
+from MazeCorpus import MazeCorpus
+
+def subsample_batches(random, mazes, batch_size, num_batches=None):
+    #rotating subsample of a node x node x number_of_mazes set or a MazeCorpus, with the index of each batch
+    #each batch takes the next batch_size mazes of a shuffled order, which is shuffled again once every maze has been used
+    corpus = isinstance(mazes, MazeCorpus)
+    total = len(mazes) if corpus else mazes.shape[2]
+    index = None if corpus else index_mazes(mazes) #indexed once, batches take slices of it
+    order = []
+    batch = 0
+    while num_batches is None or batch < num_batches:
+        while len(order) < batch_size:
+            rest = list(range(total))
+            random.shuffle(rest)
+            order.extend(rest)
+        indices = np.array(order[:batch_size])
+        del order[:batch_size]
+        if corpus:
+            yield mazes.mazes(indices), mazes.index(indices)
+        else:
+            yield mazes[:, :, indices], {key: value[indices] for key, value in index.items()}
+        batch += 1
+
+def generated_batches(random, maze_function, batch_size, schedule, num_batches=None):
+    #new maze sets from generate_mazes, schedule(batch) giving the arguments to maze_function after random for each batch
+    batch = 0
+    while num_batches is None or batch < num_batches:
+        yield generate_mazes(random, maze_function, batch_size, *schedule(batch))
+        batch += 1
+
+def growing_nodes(start, stop, every=1, density=1.5):
+    #schedule for generated_batches which grows the node count by one every given number of batches, from start up to stop
+    #with density paths per node - solvers must be made for stop nodes, and are cut down to the size of smaller mazes
+    def schedule(batch):
+        nodes = min(start + batch // every, stop)
+        return nodes, int(density * nodes)
+    return schedule
+
+def stream_batches(maze_stream, batch_size):
+    #groups a stream of single mazes (e.g. helix_mazes) into sets, ending when the stream cannot fill another set
+    #batch_size is checked before any maze is read, as a stream is read without end until a set is filled
+    if batch_size is None or batch_size < 1:
+        raise ValueError('batch_size must be a positive number of mazes, not ' + repr(batch_size))
+    return _stream_batches(iter(maze_stream), batch_size)
+
+def _stream_batches(maze_stream, batch_size):
+    while True:
+        mazes = []
+        for maze in maze_stream:
+            mazes.append(maze)
+            if len(mazes) == batch_size:
+                break
+        if len(mazes) < batch_size:
+            return
+        yield np.stack(mazes, axis=-1)
+
+class MazeProvider():
+    #iterator of (maze set, index) pairs produced by a background thread from batches, up to prefetch of them ahead
+    #batches yields maze sets, or (maze set, index) pairs for sets which are already indexed
+    def __init__(self, batches, prefetch=2):
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.closed = threading.Event()
+        self.finished = None #the exception which ended the batches, raised again by every later call
+        self.pending = None #the next item, taken from the queue early by exhausted
+        self.thread = threading.Thread(target=self._produce, args=(iter(batches),), daemon=True)
+        self.thread.start()
+
+    def _produce(self, batches):
+        try:
+            for batch in batches:
+                mazes, index = batch if isinstance(batch, tuple) else (batch, None)
+                if not self._put((mazes, index_mazes(mazes) if index is None else index, None)):
+                    return
+        except Exception as error:
+            self._put((None, None, error))
+        else:
+            self._put((None, None, StopIteration()))
+
+    def _put(self, item): #waits for room in the queue unless the provider is closed, returning whether the item was queued
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        return self
+
+    def _take(self): #the next item, waiting for the producer if it is not ready
+        if self.pending is None:
+            self.pending = self.queue.get()
+        return self.pending
+
+    def __next__(self):
+        if self.finished is not None:
+            raise self.finished
+        mazes, index, error = self._take()
+        self.pending = None
+        if error is not None:
+            self.finished = error
+            raise error
+        return mazes, index
+
+    def exhausted(self): #waits for the next set, returning whether the batches have run out instead
+        if self.finished is not None:
+            return isinstance(self.finished, StopIteration)
+        return isinstance(self._take()[2], StopIteration)
+
+    def close(self): #stops the producer, discarding any sets it has prepared
+        self.closed.set()
+        self.pending = None
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
@@ -1,7 +1,17 @@
-import collections
+import collections.abc
+import itertools
+import multiprocessing
+from random import Random
 import inspyred
+from Checkpoint import resume_evaluator
+from ParallelEvaluator import share_array, attach_arrays
 
 class MicroEC(inspyred.ec.EvolutionaryComputation):
+    #evolves a series of micro-populations, each seeded with the best individual of the one before
+    #optional keyword arguments in args:
+    #micro_evaluations -- evaluations each micro-population runs for (default 10 * pop_size)
+    #max_evaluations -- total evaluations for an evaluation_termination terminator (default micro_evaluations)
+    #observers are called once each micro-population finishes, with the generations and evaluations of all of them so far
     def __init__(self, random):
         inspyred.ec.EvolutionaryComputation.__init__(self, random)
         
@@ -21,22 +31,24 @@ class MicroEC(inspyred.ec.EvolutionaryComputation):
         self.maximize = maximize
         self.population = []
         self.archive = []
+        self.num_evaluations = 0
+        self.num_generations = 0
         microseeds = seeds
+        micro_evaluations = args.get('micro_evaluations') or 10 * pop_size
+        args.setdefault('max_evaluations', micro_evaluations)
         
         while not self._should_terminate(list(self.population), self.num_generations, self.num_evaluations):
             microec = inspyred.ec.EvolutionaryComputation(self._random)
             microec.selector = self.selector
             microec.variator = self.variator
             microec.replacer = self.replacer
-            microec.observer = self.observer
+            microec.observer = [] #only this computation's observers are called, between micro-populations
             microec.terminator = inspyred.ec.terminators.evaluation_termination
-            maxevals = args['max_evaluations']
-            args['max_evaluations'] = args['micro_evaluations']
+            microargs = dict(args, max_evaluations=micro_evaluations) #args itself keeps the overall maximum
             result = microec.evolve(generator=generator, evaluator=evaluator, 
                                     pop_size=pop_size, seeds=microseeds, 
-                                    maximize=maximize, **args)
+                                    maximize=maximize, bounder=bounder, **microargs)
             self.population = list(result)
-            args['max_evaluations'] = maxevals
             result.sort(reverse=True)
             microseeds = [result[0].candidate]
             self.num_evaluations += microec.num_evaluations
@@ -51,7 +63,7 @@ class MicroEC(inspyred.ec.EvolutionaryComputation):
                                          population=list(self.population), args=self._kwargs)
             
             self.num_generations += microec.num_generations
-            if isinstance(self.observer, collections.Iterable):
+            if isinstance(self.observer, collections.abc.Iterable):
                 for obs in self.observer:
                     obs(population=list(self.population), num_generations=self.num_generations, 
                         num_evaluations=self.num_evaluations, args=self._kwargs)
@@ -60,4 +72,157 @@ class MicroEC(inspyred.ec.EvolutionaryComputation):
                               num_evaluations=self.num_evaluations, args=self._kwargs)
         return self.population
 
-#Obtained from Inspyred Github Recipes page
\ No newline at end of file
+#Obtained from Inspyred Github Recipes page
+
+_island = {} #state of the current island worker process, set up once by _init_island
+
+def _init_island(engine, generator, evaluator, args, shared):
+    _island['engine'] = engine
+    _island['generator'] = generator
+    _island['evaluator'] = evaluator
+    _island['memory'], arrays = attach_arrays(shared) #the blocks stay open while the worker lives
+    _island['args'] = dict(args, **arrays)
+
+def _evolve_island(island, generations):
+    #advances one island by the given number of generations from the state it was left in
+    #an island which has been evolved before is resumed from its population without evaluating it again
+    engine = _island['engine']
+    random = Random()
+    random.setstate(island['random_state'])
+    computation = engine['engine'](random)
+    computation.selector = engine['selector']
+    computation.variator = engine['variator']
+    computation.replacer = engine['replacer']
+    computation.observer = []
+    computation.terminator = inspyred.ec.terminators.generation_termination
+    evaluator = _island['evaluator']
+    stats = {}
+    resumed = len(island['candidates'])
+    if resumed:
+        evaluator = resume_evaluator(evaluator, island['fitness'])
+    args = dict(_island['args'], random=random, max_generations=generations, evaluation_stats=stats) #evaluators draw from the island's generator
+    population = computation.evolve(_island['generator'], evaluator, pop_size=engine['pop_size'], 
+                                    seeds=island['candidates'] or island['seeds'], maximize=engine['maximize'], 
+                                    bounder=engine['bounder'], **args)
+    return {'seeds': [],
+            'candidates': [individual.candidate for individual in population],
+            'fitness': [individual.fitness for individual in population],
+            'random_state': random.getstate(),
+            'evaluations': computation.num_evaluations - resumed}, stats
+
+class IslandEC(inspyred.ec.EvolutionaryComputation):
+    #evolves several populations (islands) at once, each in a worker process with its own random generator
+    #every migration_interval generations the best migrants of each island replace the worst of the next island round a ring
+    #islands use this computation's selector, variator and replacer, and are MicroECs if micro_evaluations is in args
+    #arrays in args named by shared (the maze set) are placed in shared memory once instead of being sent to each worker
+    #observers and the terminator see all of the islands as one population after each migration, with generations
+    #counted per island - results do not depend on the number of workers, which defaults to one per island and core
+    #one worker evolves the islands one after another in this process, without a pool or shared memory
+    def __init__(self, random, islands=4, migration_interval=5, migrants=1, workers=None, shared=('mazes',)):
+        inspyred.ec.EvolutionaryComputation.__init__(self, random)
+        self.islands = islands
+        self.migration_interval = migration_interval
+        self.migrants = migrants
+        self.workers = workers or min(islands, multiprocessing.cpu_count())
+        self.shared = shared
+        
+    def evolve(self, generator, evaluator, pop_size=100, seeds=None, maximize=True, bounder=None, **args):
+        self._kwargs = args
+        self._kwargs['_ec'] = self
+        
+        if seeds is None:
+            seeds = []
+        if bounder is None:
+            bounder = inspyred.ec.Bounder()
+        
+        self.termination_cause = None
+        self.generator = generator
+        self.evaluator = evaluator
+        self.bounder = bounder
+        self.maximize = maximize
+        self.population = []
+        self.archive = []
+        self.num_evaluations = 0
+        self.num_generations = 0
+        islands = [{'seeds': list(seeds[i::self.islands]), 'candidates': [], 'fitness': [], 
+                    'random_state': Random(self._random.getrandbits(64)).getstate()} for i in range(self.islands)]
+        engine = {'engine': MicroEC if args.get('micro_evaluations') else inspyred.ec.EvolutionaryComputation,
+                  'selector': self.selector, 'variator': self.variator, 'replacer': self.replacer, 
+                  'pop_size': pop_size, 'maximize': maximize, 'bounder': bounder}
+        serial = self.workers == 1
+        memory = []
+        shared = {}
+        for key in () if serial else self.shared:
+            if args.get(key) is not None:
+                block, array = share_array(args[key])
+                memory.append(block)
+                shared[key] = (block.name, array.shape, array.dtype)
+        passed = {key: value for key, value in args.items() if key not in shared and key not in ('_ec', 'evaluation_stats')}
+        pool = None
+        if serial:
+            _init_island(engine, generator, evaluator, passed, shared)
+        else:
+            pool = multiprocessing.Pool(self.workers, _init_island, (engine, generator, evaluator, passed, shared))
+        
+        try:
+            while not self.population or not self._should_terminate(list(self.population), self.num_generations, self.num_evaluations):
+                generations = self.migration_interval
+                if 'max_generations' in args:
+                    generations = max(min(generations, args['max_generations'] - self.num_generations), 0)
+                stats = args.setdefault('evaluation_stats', {}) #counters gathered from the islands
+                tasks = [(island, generations) for island in islands]
+                results = list(itertools.starmap(_evolve_island, tasks)) if serial else pool.starmap(_evolve_island, tasks)
+                islands = []
+                for island, island_stats in results:
+                    islands.append(island)
+                    self.num_evaluations += island['evaluations']
+                    for key, value in island_stats.items():
+                        stats[key] = stats.get(key, 0) + value
+                self.num_generations += generations
+                
+                # Migrate individuals.
+                self._migrate(islands)
+                self.population = [individual for island in islands for individual in self._individuals(island)]
+                self.population.sort(reverse=True)
+                self.population = self.migrator(random=self._random, 
+                                                population=self.population, 
+                                                args=self._kwargs)
+                
+                # Archive individuals.
+                self.archive = self.archiver(random=self._random, archive=self.archive, 
+                                             population=list(self.population), args=self._kwargs)
+                
+                if isinstance(self.observer, collections.abc.Iterable):
+                    for obs in self.observer:
+                        obs(population=list(self.population), num_generations=self.num_generations, 
+                            num_evaluations=self.num_evaluations, args=self._kwargs)
+                else:
+                    self.observer(population=list(self.population), num_generations=self.num_generations, 
+                                  num_evaluations=self.num_evaluations, args=self._kwargs)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            _island.clear() #only set in this process when serial
+            for block in memory:
+                block.close()
+                block.unlink()
+        return self.population
+    
+    def _individuals(self, island): #an island's population as individuals, best first
+        individuals = []
+        for candidate, fitness in zip(island['candidates'], island['fitness']):
+            individual = inspyred.ec.Individual(candidate, maximize=self.maximize)
+            individual.fitness = fitness
+            individuals.append(individual)
+        individuals.sort(reverse=True)
+        return individuals
+    
+    def _migrate(self, islands): #the best of each island replace the worst of the next, all chosen before any move
+        populations = [self._individuals(island) for island in islands]
+        migrants = [population[:self.migrants] for population in populations]
+        for i, population in enumerate(populations):
+            arrivals = migrants[i - 1] if len(islands) > 1 else []
+            population = population[:len(population) - len(arrivals)] + arrivals
+            islands[i]['candidates'] = [individual.candidate for individual in population]
+            islands[i]['fitness'] = [individual.fitness for individual in population]
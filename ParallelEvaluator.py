@@ -0,0 +1,107 @@
+'''Parallel fitness evaluation over a pool of worker processes'''
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from GenerateSolver import candidate_seeds
+
+def share_array(array): #copies an array into a new block of shared memory
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, array.dtype, buffer=memory.buf)
+    shared[...] = array
+    return memory, shared
+
+def attach_array(name, shape, dtype): #views an array placed in shared memory by another process
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype, buffer=memory.buf)
+
+def attach_arrays(shared):
+    #views every array named in shared, a dict of key: (name, shape, dtype), returning the blocks and a dict of the views
+    #the blocks must be kept open for as long as the views are used
+    memory = []
+    arrays = {}
+    for key, (name, shape, dtype) in shared.items():
+        block, arrays[key] = attach_array(name, shape, dtype)
+        memory.append(block)
+    return memory, arrays
+
+_worker = {} #state of the current worker process, set up once by _init_worker
+
+def _init_worker(evaluator, shared):
+    _worker['evaluator'] = evaluator
+    _worker['memory'], _worker['args'] = attach_arrays(shared) #the blocks stay open while the worker lives
+
+def _evaluate_chunk(candidates, seeds, passed):
+    #each candidate is evaluated with its own seed so results do not depend on how candidates are partitioned
+    stats = {}
+    args = dict(_worker['args'], evaluation_stats=stats, **passed)
+    if seeds is not None:
+        args['evaluation_seeds'] = seeds
+    fitness = _worker['evaluator'](candidates, args)
+    return fitness, stats
+
+class ParallelEvaluator():
+    #wraps an evaluator so that candidates are evaluated across a pool of worker processes
+    #arrays in args named by shared (the maze set) are placed in shared memory once instead of being pickled per task
+    #small per call values in args named by passed are sent with every task, and evaluation_stats counters are gathered back
+    #seeded draws one seed per candidate from args random as evaluate_smart_solver and evaluate_smart_population do, so results
+    #are the same whatever the number of workers - it must be False for evaluators which draw nothing, or later draws would shift
+    def __init__(self, evaluator, workers=None, shared=('mazes',), passed=('cutoff', 'lower_bounds', 'maze_index', 'normalize'), chunks_per_worker=4, seeded=True):
+        self.evaluator = evaluator
+        self.workers = workers or multiprocessing.cpu_count()
+        self.shared = shared
+        self.passed = passed
+        self.chunks_per_worker = chunks_per_worker #more chunks than workers evens out uneven walk lengths
+        self.seeded = seeded
+        self.pool = None
+        self.memory = {}
+        self.arrays = {}
+        self.sources = {}
+        self.__name__ = getattr(evaluator, '__name__', type(self).__name__)
+
+    def __call__(self, candidates, args):
+        self._share(args)
+        seeds = candidate_seeds(args.get('random'), len(candidates)) if self.seeded else None #the same seeds the evaluator would draw serially
+        bounds = np.linspace(0, len(candidates), min(len(candidates), self.workers * self.chunks_per_worker) + 1).astype(int)
+        passed = {key: args.get(key) for key in self.passed if key in args}
+        tasks = [(candidates[start:stop], seeds and seeds[start:stop], passed) for start, stop in zip(bounds[:-1], bounds[1:])]
+        fitness = []
+        stats = args.get('evaluation_stats')
+        for chunk, chunk_stats in self.pool.starmap(_evaluate_chunk, tasks): #starmap returns chunks in their original order
+            fitness.extend(chunk)
+            if stats is not None:
+                for key, value in chunk_stats.items():
+                    stats[key] = stats.get(key, 0) + value
+        return fitness
+
+    def _share(self, args):
+        sources = {key: args.get(key) for key in self.shared if args.get(key) is not None}
+        if self.pool is not None and sources.keys() == self.sources.keys():
+            for key, source in sources.items():
+                if source is self.sources[key]:
+                    continue
+                if source.shape != self.arrays[key].shape or source.dtype != self.arrays[key].dtype:
+                    break
+                self.arrays[key][...] = source #workers are idle between calls, so a same shaped array is copied in place
+                self.sources[key] = source
+            else:
+                return
+        self.close()
+        shared = {}
+        for key, source in sources.items():
+            self.memory[key], self.arrays[key] = share_array(source)
+            shared[key] = (self.memory[key].name, source.shape, source.dtype)
+        self.sources = sources
+        self.pool = multiprocessing.Pool(self.workers, _init_worker, (self.evaluator, shared))
+
+    def close(self): #shuts down the workers and releases the shared memory
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.arrays = {} #views must be released before the shared blocks can close
+        for memory in self.memory.values():
+            memory.close()
+            memory.unlink()
+        self.memory = {}
+        self.sources = {}
@@ -1,48 +1,122 @@
 '''Single run evaluation of given solver on given maze'''
 
+import contextlib
+import io
+import os
+import tempfile
 from random import Random
 from time import time
 from GenerateMaze import *
 from GenerateSolver import *
+from ParallelEvaluator import ParallelEvaluator
+from MazeCorpus import write_corpus
+from Benchmark import load_evolution
 
-def evaluate_solver(solver, maze, random):
+def evaluate_solver(solver, maze, generator): #generator is a numpy Generator
 	nodes = maze.shape[0] #number of nodes in the maze
-	
-	unvisited = [1 for x in range(nodes)] #list of 1s in place of each unvisited node, 0s for each visited node
-	tensor = np.zeros((nodes, nodes), np.int8)
-	current = 0 #current node initialized to beginning node of maze
-	steps = 0 #number of moves made so far
-	visit(0, unvisited, tensor)
+	walk = SolverWalk(unpack_solver(solver), maze)
 			
-	while current != nodes - 1 and steps < nodes**2:
+	while walk.current != nodes - 1 and walk.steps < nodes**2:
 		choice = -1
 		layer = -1
-		known = np.multiply(tensor, maze) #yields the information of maze adjacency as known by solver at current time
 			
 		while choice < 0:
 			try:
-				M = matrix_operate(known, solver[:, :, layer]) #performs solver matrix operation to determine which path to take
+				result = walk.options(layer) #performs solver matrix operation to determine which path to take
 			except IndexError:
 				print('Index Error')
 				break
-			result = np.multiply(np.dot(unvisited, M), maze[current, :]) #multiplication by maze adj matrix eliminates impossible choices
-			(choice,) = choose(random, result)
+			(choice,) = choose(generator, result)
 			layer -= 1
 					
-		current = choice
-		steps += 1
-		visit(choice, unvisited, tensor)
+		walk.move(choice)
 						
-	return steps
+	return walk.steps
 
-def do_test(nodes, paths, complexity, maze_function=generate_simple_maze, solver_function=identity_solver):    
+def do_test(nodes, paths, complexity, maze_function=generate_simple_maze, solver_function=identity_solver, seed=None):    
+    seed = int(time()) if seed is None else seed
     rand = Random()
-    rand.seed(int(time()))
+    rand.seed(seed)
 
     maze = maze_function(rand, nodes, paths)
     solver = solver_function(nodes, complexity)
-    print(evaluate_solver(solver, maze, rand))
+    print(evaluate_solver(solver, maze, np.random.default_rng(seed)))
 
     print_multi_nparray(maze)
 
-do_test(10, 15, 2)
\ No newline at end of file
+def check_workers(nodes, paths, complexity, num_mazes=5, solvers=12, seed=0, workers=(2, 3)):
+    #checks that each evaluator gives the same fitness and leaves the random generator in the same state
+    #when evaluating across worker processes as it does alone
+    rand = Random(seed)
+    mazes = generate_mazes(rand, generate_simple_maze, num_mazes, nodes, paths)
+    smart = [generate_smart_solver(rand, {'nodes': nodes, 'complexity': complexity}) for i in range(solvers)]
+    memory = [generate_memory_solver(rand, {'maze': mazes[:, :, 0]}) for i in range(solvers)]
+    checks = [(evaluate_smart_solver, smart, {'mazes': mazes}, True),
+              (evaluate_smart_population, smart, {'mazes': mazes}, True),
+              (evaluate_memory_solver, memory, {'maze': mazes[:, :, 0]}, False)]
+    for evaluator, candidates, args, seeded in checks:
+        serial = Random(seed)
+        expected = evaluator(candidates, dict(args, random=serial))
+        for count in workers:
+            master = Random(seed)
+            parallel = ParallelEvaluator(evaluator, count, seeded=seeded)
+            try:
+                assert parallel(candidates, dict(args, random=master)) == expected, evaluator.__name__ + ' differs with ' + str(count) + ' workers'
+            finally:
+                parallel.close()
+            assert master.getstate() == serial.getstate(), evaluator.__name__ + ' draws differently with ' + str(count) + ' workers'
+    print('Evaluation is the same with 1, ' + ', '.join(str(count) for count in workers) + ' workers')
+
+def check_walk(nodes, paths, complexity, num_mazes=5, solvers=5, seed=0):
+    #checks that the options of SolverWalk, updated incrementally, are identical to recomputing them
+    #from the whole known matrix at every step, following the same choices with a fixed generator
+    rand = Random(seed)
+    mazes = generate_mazes(rand, generate_simple_maze, num_mazes, nodes, paths)
+    generator = np.random.default_rng(seed)
+    for i in range(solvers):
+        solver = unpack_solver(generate_smart_solver(rand, {'nodes': nodes, 'complexity': complexity}))
+        for maze in range(num_mazes):
+            walk = SolverWalk(solver, mazes[:, :, maze])
+            unvisited = np.ones(nodes, np.int64)
+            tensor = np.zeros((nodes, nodes), np.int8)
+            visit(0, unvisited, tensor)
+            while walk.current != nodes - 1 and walk.steps < nodes**2:
+                known = np.multiply(tensor, mazes[:, :, maze])
+                choice = -1
+                layer = -1
+                while choice < 0 and layer >= -complexity:
+                    expected = np.multiply(np.dot(unvisited, matrix_operate(known, solver[:, :, layer])), mazes[walk.current, :, maze])
+                    assert np.array_equal(walk.options(layer), expected), 'walk options differ at step ' + str(walk.steps)
+                    (choice,) = choose(generator, expected)
+                    layer -= 1
+                if choice < 0: #out of layers, the walk is stuck
+                    break
+                walk.move(choice)
+                visit(choice, unvisited, tensor)
+    print('Incremental walks are the same as recomputing every step')
+
+def check_resume(nodes, paths, complexity, num_mazes=3, solvers=10, generations=6, seed=0):
+    #checks that a run checkpointed half way and resumed ends with the same population as the run done straight through,
+    #with the mazes stored in the checkpoint and with them read from a corpus
+    evolution = load_evolution()
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()): #stats_observer prints every generation
+        corpus = os.path.join(directory, 'mazes.corpus')
+        write_corpus(corpus, generate_mazes(Random(seed), generate_simple_maze, num_mazes + 2, nodes, paths))
+        for mazes in ({}, {'maze_corpus': corpus, 'maze_indices': range(1, num_mazes + 1)}):
+            args = dict(mazes, mazes=num_mazes, nodes=nodes, paths=paths, solvers=solvers, sel_pressure=solvers, complexity=complexity,
+                        mutations=nodes, seed=seed)
+            straight, straight_mazes = evolution.evolve_smart_solvers(generations=generations, **args)
+            path = os.path.join(directory, 'run.npz')
+            evolution.evolve_smart_solvers(generations=generations // 2, checkpoint=path, checkpoint_every=generations // 2, **args)
+            resumed, resumed_mazes = evolution.resume_smart_solvers(path, generations=generations)
+            assert np.array_equal(straight_mazes, resumed_mazes), 'resumed run solves other mazes'
+            assert [x.fitness for x in straight] == [x.fitness for x in resumed], 'resumed run ends with other fitness'
+            assert all(np.array_equal(x.candidate.packed, y.candidate.packed) for x, y in zip(straight, resumed)), 'resumed run ends with other solvers'
+    print('Resuming from a checkpoint is the same as running straight through')
+
+do_test(10, 15, 2)
+
+if __name__ == '__main__': #worker processes import this module again when they are spawned
+    check_workers(10, 15, 2)
+    check_walk(10, 15, 3)
+    check_resume(10, 15, 2)
\ No newline at end of file